@@ -0,0 +1,272 @@
+"""
+Benchmark a full refresh against the local mock API server.
+
+Starts benchmarks/mockserver.py in a separate process (so its CPU time is not
+counted) for each scale and measures, on the integration side:
+
+    login           PersonalCapital.login
+    cold refresh    the first PersonalCapitalAccountData.async_update
+    warm refresh    a refresh where nothing changed upstream
+    changed refresh a refresh after one balance and one transaction changed
+    sensor update   rebuilding every sensor after a change
+
+reporting the best wall time and CPU time over --repeat rounds and the peak
+Python memory of one traced round. Needs Home Assistant installed, like the
+integration itself.
+
+    python benchmarks/bench_refresh.py
+    python benchmarks/bench_refresh.py --scales small large --save-baseline
+    python benchmarks/bench_refresh.py --compare
+
+--save-baseline stores the results in benchmarks/baseline.json (or --baseline
+PATH); --compare reports the change against it and exits with status 1 if a
+timing got more than --tolerance slower or memory grew more than --tolerance.
+Baselines are only comparable on the machine that recorded them.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import aiohttp
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, '..', 'custom_components'))
+
+import mockserver  # noqa: E402
+from personalcapital import sensor  # noqa: E402
+
+SCALES = {
+    'small': {'accounts': 10, 'transactions': 300, 'categories': 20, 'split_ratio': 0.05},
+    'medium': {'accounts': 50, 'transactions': 3000, 'categories': 60, 'split_ratio': 0.05},
+    'large': {'accounts': 200, 'transactions': 20000, 'categories': 120, 'split_ratio': 0.1},
+    'huge': {'accounts': 500, 'transactions': 100000, 'categories': 200, 'split_ratio': 0.1},
+}
+PHASES = ['login', 'cold refresh', 'warm refresh', 'changed refresh', 'sensor update']
+DEFAULT_BASELINE = os.path.join(HERE, 'baseline.json')
+
+
+class BenchConfig(object):
+    def __init__(self, config_dir):
+        self.config_dir = config_dir
+
+    def path(self, *path):
+        return os.path.join(self.config_dir, *path)
+
+
+class BenchBus(object):
+    def async_listen_once(self, event, callback):
+        pass
+
+
+class BenchHass(object):
+    """The few parts of Home Assistant PersonalCapitalAccountData and the sensors use."""
+
+    def __init__(self, config_dir):
+        self.data = {}
+        self.config = BenchConfig(config_dir)
+        self.bus = BenchBus()
+
+    async def async_add_executor_job(self, target, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, target, *args)
+
+
+class Household(object):
+    """One login against the mock server, rebuilt from scratch for every round."""
+
+    def __init__(self, base, session):
+        self.base = base
+        self.session = session
+        self.config_dir = tempfile.mkdtemp(prefix='pc-bench-')
+        self.hass = BenchHass(self.config_dir)
+        self.pc = sensor.PersonalCapital(session, base)
+        self.rest = sensor.PersonalCapitalAccountData(self.hass, self.pc, {
+            sensor.CONF_EMAIL: 'bench@example.com',
+            sensor.CONF_PASSWORD: 'bench',
+        })
+        self.sensors = []
+
+    async def login(self):
+        await self.pc.login('bench@example.com', 'bench')
+        self.rest.login_done.set()
+
+    async def refresh(self):
+        # make every request due, as on the first refresh
+        self.rest._accounts_schedule.due = 0
+        self.rest._transactions_schedule.due = 0
+        await self.rest.async_update()
+
+    async def mutate(self):
+        async with self.session.post(self.base + '/bench/mutate') as response:
+            await response.read()
+
+    def build_sensors(self):
+        uom = 'USD'
+        self.sensors = [
+            sensor.PersonalCapitalNetWorthSensor(None, self.rest, uom),
+            sensor.PersonalCapitalBudgetSensor(None, self.rest, self.hass, uom),
+        ] + [
+            sensor.PersonalCapitalCategorySensor(None, self.hass, self.rest, uom, category)
+            for category in sensor.SENSOR_TYPES
+        ]
+
+    def update_sensors(self):
+        for entity in self.sensors:
+            entity._fingerprint = None
+            entity._refresh()
+            entity.extra_state_attributes
+
+    async def close(self):
+        if self.rest._store is not None:
+            self.rest._store.close()
+        shutil.rmtree(self.config_dir, ignore_errors=True)
+
+
+async def measure(run, repeat, setup=None):
+    """
+    Return {metric: value} for the async callable run: the best of repeat
+    rounds, plus one traced round for the memory peak. If given, setup is
+    awaited (untimed) before every round and its result passed to run.
+    """
+    async def one_round():
+        args = () if setup is None else (await setup(),)
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        await run(*args)
+        return time.perf_counter() - wall_start, time.process_time() - cpu_start
+
+    wall = cpu = float('inf')
+    for _ in range(repeat):
+        round_wall, round_cpu = await one_round()
+        wall, cpu = min(wall, round_wall), min(cpu, round_cpu)
+
+    tracemalloc.start()
+    try:
+        await one_round()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'wall_ms': wall * 1000, 'cpu_ms': cpu * 1000, 'peak_kib': peak / 1024}
+
+
+async def bench_scale(base, repeat):
+    results = {}
+    async with aiohttp.ClientSession(cookie_jar=aiohttp.CookieJar(unsafe=True)) as session:
+        households = []
+
+        async def fresh():
+            household = Household(base, session)
+            households.append(household)
+            return household
+
+        async def logged_in():
+            household = await fresh()
+            await household.login()
+            return household
+
+        results['login'] = await measure(Household.login, repeat, fresh)
+        results['cold refresh'] = await measure(Household.refresh, repeat, logged_in)
+
+        household = await fresh()
+        await household.login()
+        await household.refresh()
+        household.build_sensors()
+
+        results['warm refresh'] = await measure(household.refresh, repeat)
+
+        async def changed():
+            await household.mutate()
+            await household.refresh()
+
+        results['changed refresh'] = await measure(changed, repeat)
+
+        async def update_sensors():
+            household.update_sensors()
+
+        results['sensor update'] = await measure(update_sensors, repeat)
+
+        for household in households:
+            await household.close()
+    return results
+
+
+def run_scale(name, scale, repeat):
+    parent, child = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=mockserver.serve, args=(scale, child), daemon=True)
+    server.start()
+    try:
+        base = parent.recv()
+        return asyncio.run(bench_scale(base, repeat))
+    finally:
+        parent.send('stop')
+        server.join(10)
+
+
+def compare(results, baseline, tolerance):
+    """Print the change against baseline and return whether anything regressed."""
+    regressed = False
+    print()
+    print(f'{"scale":<8} {"phase":<16} {"metric":<9} {"baseline":>10} {"now":>10} {"change":>8}')
+    for name, phases in results.items():
+        for phase, metrics in phases.items():
+            for metric, value in metrics.items():
+                before = baseline.get(name, {}).get(phase, {}).get(metric)
+                if not before:
+                    continue
+                change = value / before - 1
+                flag = ''
+                if change > tolerance:
+                    flag = '  REGRESSION'
+                    regressed = True
+                print(f'{name:<8} {phase:<16} {metric:<9} {before:>10.1f} {value:>10.1f} {change:>+7.0%}{flag}')
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scales', nargs='+', choices=SCALES, default=['small', 'medium', 'large'])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline file (default %(default)s)')
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the baseline')
+    parser.add_argument('--compare', action='store_true', help='compare against the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='relative slowdown or growth that counts as a regression (default %(default)s)')
+    args = parser.parse_args()
+
+    results = {}
+    print(f'{"scale":<8} {"phase":<16} {"wall (ms)":>10} {"cpu (ms)":>10} {"peak (KiB)":>11}')
+    for name in args.scales:
+        results[name] = run_scale(name, SCALES[name], args.repeat)
+        for phase in PHASES:
+            metrics = results[name][phase]
+            print(f'{name:<8} {phase:<16} {metrics["wall_ms"]:>10.1f} {metrics["cpu_ms"]:>10.1f} '
+                  f'{metrics["peak_kib"]:>11.0f}')
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as baseline_file:
+                baseline = json.load(baseline_file)
+        baseline.update(results)
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+        print(f'\nSaved baseline to {args.baseline}')
+
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            sys.exit(f'No baseline at {args.baseline}, record one with --save-baseline')
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Replay a recorded cassette through PersonalCapitalAccountData as fast as it goes.
+
+Record one by setting `cassette: record` on a login, which writes
+.pc-cassette.jsonl.gz next to the session file as it refreshes. Replaying it
+needs no network and no credentials, and runs one refresh after another
+instead of waiting for the refresh interval:
+
+    python benchmarks/bench_replay.py ~/.homeassistant/.pc-cassette.jsonl.gz
+    python benchmarks/bench_replay.py CASSETTE --refreshes 500 --profile
+
+Only the first refresh asks for the transaction window that was recorded;
+the later ones get the recorded transactions for their own windows, which
+is close enough to time them.
+
+Every refresh re-requests everything, as if the schedules were due, and
+rebuilds every sensor. Reports the p50/p95 of both and the per-stage timings.
+Needs Home Assistant installed, like the integration itself.
+"""
+
+import argparse
+import asyncio
+import cProfile
+import os
+import pstats
+import shutil
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, '..', 'custom_components'))
+
+from bench_refresh import BenchHass  # noqa: E402
+from personalcapital import sensor  # noqa: E402
+from personalcapital.cassette import REPLAY, Cassette  # noqa: E402
+from personalcapital.metrics import percentile  # noqa: E402
+
+
+async def replay(path, refreshes, periods):
+    cassette = Cassette(path, REPLAY, fallback=True).load()
+    config_dir = tempfile.mkdtemp(prefix='pc-replay-')
+    try:
+        hass = BenchHass(config_dir)
+        pc = sensor.PersonalCapital(cassette=cassette)
+        rest = sensor.PersonalCapitalAccountData(hass, pc, {
+            sensor.CONF_EMAIL: 'replay@example.com',
+            sensor.CONF_PASSWORD: 'replay',
+            sensor.CONF_BUDGET_PERIODS: periods,
+        })
+        rest.login_done.set()
+        uom = 'USD'
+        sensors = [sensor.PersonalCapitalNetWorthSensor(None, rest, uom)] + [
+            sensor.PersonalCapitalBudgetSensor(None, rest, hass, uom, period) for period in periods
+        ] + [
+            sensor.PersonalCapitalCategorySensor(None, hass, rest, uom, category)
+            for category in sensor.SENSOR_TYPES
+        ]
+
+        refresh_times, sensor_times = [], []
+        for _ in range(refreshes):
+            rest._accounts_schedule.due = 0
+            rest._transactions_schedule.due = 0
+            # the replayed change id never moves, which would skip the transaction delta
+            rest._transactions_change_id = None
+            start = time.perf_counter()
+            await rest.async_update()
+            refresh_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            for entity in sensors:
+                entity._fingerprint = None
+                entity._refresh()
+                entity.extra_state_attributes
+            sensor_times.append(time.perf_counter() - start)
+
+        if rest._store is not None:
+            rest._store.close()
+        return refresh_times, sensor_times, pc.metrics.as_dict()
+    finally:
+        shutil.rmtree(config_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('cassette', help='cassette recorded with `cassette: record`')
+    parser.add_argument('--refreshes', type=int, default=100)
+    parser.add_argument('--budget-periods', nargs='+', choices=sensor.BUDGET_PERIODS, default=['month'])
+    parser.add_argument('--profile', action='store_true', help='print the top functions by cumulative time')
+    args = parser.parse_args()
+
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler is not None:
+        profiler.enable()
+    refresh_times, sensor_times, metrics = asyncio.run(replay(args.cassette, args.refreshes, args.budget_periods))
+    if profiler is not None:
+        profiler.disable()
+
+    print(f'{"":<16} {"p50 (ms)":>10} {"p95 (ms)":>10}')
+    for name, samples in (('refresh', refresh_times), ('sensor update', sensor_times)):
+        print(f'{name:<16} {percentile(samples, 0.5) * 1000:>10.2f} {percentile(samples, 0.95) * 1000:>10.2f}')
+    for name, stats in metrics['stages'].items():
+        print(f'  {name:<14} {stats["p50_ms"]:>10.2f} {stats["p95_ms"]:>10.2f}')
+    if profiler is not None:
+        print()
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(25)
+
+
+if __name__ == '__main__':
+    main()
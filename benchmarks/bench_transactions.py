@@ -0,0 +1,137 @@
+"""
+Benchmark the category aggregation behind the budget sensors.
+
+Builds synthetic months of transactions and times the path a refresh takes
+(budget rows into SpendingColumns, a month window's running totals, named
+and sorted by summarize_category_totals) against the previous pandas
+per-category mask implementation, so the scaling with the number of
+transactions and categories is visible. pandas is only needed for the
+legacy comparison (skip it with --skip-legacy).
+
+    python benchmarks/bench_transactions.py
+    python benchmarks/bench_transactions.py --sizes 10000 100000 --categories 120
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'custom_components'))
+
+from personalcapital.sensor import summarize_category_totals  # noqa: E402
+from personalcapital.spending import SpendingColumns  # noqa: E402
+from personalcapital.store import spending_rows  # noqa: E402
+
+
+def make_categories(count):
+    return [{'transactionCategoryId': i, 'name': f'Category {i}'} for i in range(count)]
+
+
+def make_transactions(count, categories, split_ratio=0.05, seed=0, month='2024-01'):
+    rng = random.Random(seed)
+    transactions = []
+    for i in range(count):
+        transaction = {
+            'userTransactionId': i,
+            'categoryId': rng.randrange(categories),
+            'categoryName': 'Uncategorized',
+            'amount': round(rng.uniform(1, 250), 2),
+            'includeInCashManager': rng.random() > 0.05,
+            'isCashIn': rng.random() < 0.05,
+            'isInterest': False,
+            'isIncome': rng.random() < 0.02,
+            'isCredit': rng.random() < 0.02,
+            'transactionDate': '%s-%02d' % (month, 1 + i % 28),
+        }
+        if rng.random() < split_ratio:
+            first = round(transaction['amount'] / 2, 2)
+            transaction['splits'] = [
+                {'categoryId': rng.randrange(categories), 'amount': first},
+                {'categoryId': rng.randrange(categories), 'amount': transaction['amount'] - first},
+            ]
+        transactions.append(transaction)
+    return transactions
+
+
+def aggregate(transactions, categories, month='2024-01'):
+    """Load the budget rows of transactions into SpendingColumns and total the month like a refresh."""
+    spending = SpendingColumns()
+    spending.load(
+        (transaction['userTransactionId'], transaction['transactionDate'], category_id, category_name, amount)
+        for transaction in transactions
+        for category_id, category_name, amount in spending_rows(transaction))
+    # make_transactions dates them from the 1st to the 28th
+    first = date.fromisoformat(f'{month}-01')
+    spending.set_window('month', first, first.replace(day=28))
+    return summarize_category_totals(spending.totals('month'), categories)
+
+
+def legacy_aggregate(transactions, categories):
+    """The per-category / per-split mask pipeline getTransactions used to run."""
+    import pandas
+
+    transactions = list(transactions)
+    splitTransactions = []
+    for i in list(transactions):
+        if 'splits' in i.keys():
+            transactions.remove(i)
+            splitTransactions.extend(i['splits'])
+
+    df = pandas.DataFrame(transactions)
+    df_filtered = df.loc[df['includeInCashManager'] == True].copy()
+    for category in categories:
+        df_filtered['categoryName'] = df_filtered['categoryName'].mask(
+            df_filtered['categoryId'] == category['transactionCategoryId'], category['name'])
+
+    df_filtered['amount'] = df_filtered['amount'].mask(
+        (df_filtered['isCashIn'] == True) |
+        (df_filtered['isInterest'] == True) |
+        (df_filtered['isIncome'] == True) |
+        (df_filtered['isCredit'] == True), df_filtered['amount'] * -1)
+
+    sum = []
+    for key, item in df_filtered.groupby('categoryName'):
+        sum.append({'name': key, 'amount': item['amount'].sum(), 'categoryId': item.categoryId.iat[0]})
+    amount_df = pandas.DataFrame(sum, columns=['name', 'amount', 'categoryId'])
+
+    for split in splitTransactions:
+        amount_df['amount'] = amount_df['amount'].mask(
+            amount_df['categoryId'] == split['categoryId'], amount_df['amount'] + split['amount'])
+
+    return amount_df.sort_values(by=['amount'], ascending=False)
+
+
+def best_of(func, repeat, *args):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 25000, 50000, 100000])
+    parser.add_argument('--categories', type=int, default=60)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--skip-legacy', action='store_true', help='only time the current implementation')
+    args = parser.parse_args()
+
+    categories = make_categories(args.categories)
+    print(f'{"transactions":>12} {"current (ms)":>14} {"legacy (ms)":>13} {"speedup":>8}')
+    for size in args.sizes:
+        transactions = make_transactions(size, args.categories)
+        current = best_of(aggregate, args.repeat, transactions, categories)
+        if args.skip_legacy:
+            print(f'{size:>12} {current * 1000:>14.1f}')
+            continue
+        legacy = best_of(legacy_aggregate, args.repeat, transactions, categories)
+        print(f'{size:>12} {current * 1000:>14.1f} {legacy * 1000:>13.1f} {legacy / current:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
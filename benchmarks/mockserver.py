@@ -0,0 +1,161 @@
+"""
+Local stand-in for the personalcapital.com API used by the benchmarks.
+
+Serves synthetic accounts, transactions and categories at a given scale for
+the endpoints the integration calls. Authentication always succeeds, so a
+benchmark measures the integration and not the login flow. POST /bench/mutate
+changes one balance and one transaction, so the next refresh sees new data.
+
+Run it on its own to poke at it with the integration or curl:
+
+    python benchmarks/mockserver.py --accounts 100 --transactions 5000 --port 8080
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+from datetime import date
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_transactions import make_categories, make_transactions  # noqa: E402
+
+PRODUCT_TYPES = [
+    ('INVESTMENT', ''), ('MORTGAGE', ''), ('BANK', 'Cash'), ('OTHER_ASSETS', ''),
+    ('OTHER_LIABILITIES', ''), ('CREDIT_CARD', ''), ('LOAN', ''),
+]
+
+
+def make_accounts(count):
+    accounts = []
+    for i in range(count):
+        product_type, account_type = PRODUCT_TYPES[i % len(PRODUCT_TYPES)]
+        accounts.append({
+            'userAccountId': i,
+            'name': f'Account {i}',
+            'firmName': f'Firm {i % 10}',
+            'logoPath': f'https://example.com/logo/{i % 10}.png',
+            'balance': 1000.0 + i,
+            'productType': product_type,
+            'accountType': account_type,
+            'homeUrl': 'https://example.com',
+            'currency': 'USD',
+            'lastRefreshed': 1700000000000 + i,
+            'closeDate': '',
+        })
+    return accounts
+
+
+class MockPersonalCapital(object):
+    """aiohttp application serving one synthetic household."""
+
+    def __init__(self, accounts=20, transactions=500, categories=30, split_ratio=0.05):
+        month = date.today().strftime('%Y-%m')
+        self.accounts = make_accounts(accounts)
+        self.transactions = [
+            transaction for transaction in make_transactions(transactions, categories, split_ratio, month=month)
+            if transaction['transactionDate'] <= date.today().isoformat()
+        ]
+        self.categories = make_categories(categories)
+        self.change_id = 1
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get('/page/login/goHome', self.home)
+        app.router.add_post('/bench/mutate', self.mutate)
+        app.router.add_post('/api/{endpoint:.*}', self.api)
+        return app
+
+    def ok(self, data):
+        return web.json_response({
+            'spHeader': {
+                'success': True,
+                'csrf': 'c0ffee-0000',
+                'authLevel': 'USER_REMEMBERED',
+                'lastServerChangeId': self.change_id,
+            },
+            'spData': data,
+        })
+
+    async def home(self, request):
+        return web.Response(text="<script>window.csrf ='c0ffee-0000'</script>", content_type='text/html')
+
+    async def mutate(self, request):
+        self.change_id += 1
+        self.accounts[self.change_id % len(self.accounts)]['balance'] += 1.0
+        if self.transactions:
+            self.transactions[self.change_id % len(self.transactions)]['amount'] += 1.0
+        return web.json_response({'changeId': self.change_id})
+
+    async def api(self, request):
+        endpoint = '/' + request.match_info['endpoint']
+        form = await request.post()
+        if endpoint == '/newaccount/getAccounts':
+            return self.ok({
+                'networth': sum(account['balance'] for account in self.accounts),
+                'assets': sum(account['balance'] for account in self.accounts),
+                'liabilities': 0.0,
+                'accounts': self.accounts,
+            })
+        if endpoint == '/transaction/getUserTransactions':
+            start, end = form.get('startDate', ''), form.get('endDate', '9999')
+            return self.ok({
+                'startDate': start,
+                'endDate': end,
+                'transactions': [
+                    transaction for transaction in self.transactions
+                    if start <= transaction['transactionDate'] <= end
+                ],
+            })
+        if endpoint == '/transactioncategory/getCategories':
+            return self.ok(self.categories)
+        # /login/identifyUser, /login/querySession, /credential/* and anything else
+        return self.ok({})
+
+
+async def start(mock, host='127.0.0.1', port=0):
+    """Start serving mock and return (runner, base url)."""
+    runner = web.AppRunner(mock.app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://{host}:{port}'
+
+
+def serve(scale, connection):
+    """
+    Process entry point: serve a MockPersonalCapital built from the scale
+    dict, send the base url over connection and stop when it is closed.
+    """
+    async def run():
+        runner, base = await start(MockPersonalCapital(**scale))
+        connection.send(base)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, connection.recv)
+        await runner.cleanup()
+
+    try:
+        asyncio.run(run())
+    except EOFError:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--accounts', type=int, default=20)
+    parser.add_argument('--transactions', type=int, default=500)
+    parser.add_argument('--categories', type=int, default=30)
+    parser.add_argument('--split-ratio', type=float, default=0.05)
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args()
+
+    mock = MockPersonalCapital(args.accounts, args.transactions, args.categories, args.split_ratio)
+    web.run_app(mock.app(), host='127.0.0.1', port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+Record and replay of the Personal Capital API traffic.
+
+A cassette is a gzip-compressed JSON lines file with one api request per
+line: the endpoint, the form data sent and the response body. Credentials
+and session tokens are redacted before anything is written, and cookies are
+never recorded. Replaying serves the recorded bodies back without touching
+the network, so refreshes can be profiled offline against real payloads and
+as often as needed.
+
+Loading and saving block and are meant to be run in the executor.
+"""
+
+import gzip
+import json
+import logging
+
+import aiohttp
+
+_LOGGER = logging.getLogger(__name__)
+
+RECORD = 'record'
+REPLAY = 'replay'
+MODES = (RECORD, REPLAY)
+
+REDACTED = '<redacted>'
+REDACTED_FIELDS = frozenset(('username', 'passwd', 'password', 'code', 'csrf'))
+# form fields that differ on every run and are ignored when matching a request
+VOLATILE_FIELDS = REDACTED_FIELDS | {'lastServerChangeId'}
+# form fields that select what a response covers, so another request's response would be wrong data
+DATE_FIELDS = frozenset(('startDate', 'endDate'))
+
+
+class CassetteMissError(aiohttp.ClientError):
+    """Raised when a replayed request was never recorded."""
+
+
+def redact(value):
+    """Return value with the REDACTED_FIELDS of every nested dict replaced."""
+    if isinstance(value, dict):
+        return {
+            key: REDACTED if key in REDACTED_FIELDS and item not in (None, '') else redact(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [redact(item) for item in value]
+    return value
+
+
+def _request_key(endpoint, data):
+    return endpoint, tuple(sorted(
+        (key, str(value)) for key, value in (data or {}).items() if key not in VOLATILE_FIELDS))
+
+
+class ReplayResponse(object):
+    """Stands in for the aiohttp response of a replayed request."""
+
+    __slots__ = ('status', '_body')
+
+    def __init__(self, body):
+        self.status = 200
+        self._body = body
+
+    @property
+    def content(self):
+        return self
+
+    async def read(self):
+        return self._body
+
+    async def iter_chunked(self, size):
+        for offset in range(0, len(self._body), size):
+            yield self._body[offset:offset + size]
+
+
+class Cassette(object):
+    """
+    The api requests of a PersonalCapital client, saved to path in RECORD
+    mode or served from it in REPLAY mode.
+
+    A replayed request gets the responses recorded for the same endpoint and
+    form data in turn. Once they are used up the last one is served again, so
+    a cassette can be replayed any number of times.
+
+    A request whose form data was not recorded gets the responses of the same
+    endpoint instead only if it has no DATE_FIELDS, or if fallback is set
+    (e.g. to replay a transaction window of another day, which then gets the
+    recorded day's transactions). A warning is logged the first time an
+    endpoint falls back.
+    """
+
+    def __init__(self, path, mode=RECORD, fallback=False):
+        if mode not in MODES:
+            raise ValueError(f"Unknown cassette mode {mode!r}")
+        self.path = path
+        self.mode = mode
+        self.fallback = fallback
+        self._warned = set()
+        self._pending = []
+        self._started = False
+        self._exact = {}
+        self._by_endpoint = {}
+
+    @property
+    def recording(self):
+        return self.mode == RECORD
+
+    @property
+    def replaying(self):
+        return self.mode == REPLAY
+
+    @property
+    def dirty(self):
+        """Return whether there are recorded requests that are not saved yet."""
+        return bool(self._pending)
+
+    def record(self, endpoint, data, body):
+        """Add a request and its raw response body, redacted."""
+        try:
+            response = {'json': redact(json.loads(body))}
+        except ValueError:
+            response = {'text': body.decode('utf-8', 'replace')}
+        self._pending.append(dict(endpoint=endpoint, request=redact(dict(data or {})), **response))
+
+    def play(self, endpoint, data):
+        """Return the ReplayResponse of a request, or raise CassetteMissError."""
+        queue = self._exact.get(_request_key(endpoint, data))
+        if queue is None:
+            if not self.fallback and DATE_FIELDS.intersection(data or {}):
+                raise CassetteMissError(
+                    f"{endpoint} for these dates is not in the cassette {self.path} and fallback is off")
+            queue = self._by_endpoint.get(endpoint)
+            if queue is None:
+                raise CassetteMissError(f"{endpoint} is not in the cassette {self.path}")
+            if endpoint not in self._warned:
+                self._warned.add(endpoint)
+                _LOGGER.warning("Replaying %s with responses recorded for other form data", endpoint)
+        responses, served = queue
+        queue[1] = served + 1
+        return ReplayResponse(responses[min(served, len(responses) - 1)])
+
+    def load(self):
+        """Read the cassette for replaying. Raises IOError if it can not be read."""
+        with gzip.open(self.path, 'rt') as cassette_file:
+            for line in cassette_file:
+                if not line.strip():
+                    continue
+                interaction = json.loads(line)
+                endpoint = interaction['endpoint']
+                if 'json' in interaction:
+                    body = json.dumps(interaction['json']).encode()
+                else:
+                    body = interaction.get('text', '').encode()
+                for key, queues in ((_request_key(endpoint, interaction.get('request')), self._exact),
+                                    (endpoint, self._by_endpoint)):
+                    queues.setdefault(key, [[], 0])[0].append(body)
+        return self
+
+    def save(self):
+        """Write the requests recorded since the last save, starting a new file on the first."""
+        pending, self._pending = self._pending, []
+        try:
+            with gzip.open(self.path, 'at' if self._started else 'wt') as cassette_file:
+                for interaction in pending:
+                    cassette_file.write(json.dumps(interaction, separators=(',', ':')) + '\n')
+        except OSError:
+            self._pending = pending + self._pending
+            raise
+        self._started = True
@@ -0,0 +1,140 @@
+"""
+Net worth history cache for the Personal Capital sensors.
+
+Daily net worth, assets and liabilities are kept as parallel typed arrays
+(one column per value, keyed by the date's ordinal) and saved as a single
+binary file, so years of history take a few kilobytes and load without
+parsing. Old points are thinned out as they age: daily for the last
+DAILY_DAYS, one point per week up to WEEKLY_DAYS and one per month beyond.
+
+Loading and saving block and are meant to be run in the executor.
+"""
+
+import os
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date
+
+MAGIC = b'PCNW'
+VERSION = 1
+HEADER = struct.Struct('<4sHI')
+COLUMNS = ('networth', 'assets', 'liabilities')
+
+DAILY_DAYS = 120
+WEEKLY_DAYS = 400
+
+
+def _bucket(day, today):
+    """Return the key of the downsampling bucket a date ordinal falls in."""
+    age = today - day
+    if age <= DAILY_DAYS:
+        return day
+    d = date.fromordinal(day)
+    if age <= WEEKLY_DAYS:
+        return tuple(d.isocalendar()[:2])
+    return d.year, d.month
+
+
+class NetWorthHistory(object):
+    """Columnar cache of (day, networth, assets, liabilities) points, oldest first."""
+
+    __slots__ = ('days', 'networth', 'assets', 'liabilities')
+
+    def __init__(self):
+        self.days = array('i')
+        self.networth = array('d')
+        self.assets = array('d')
+        self.liabilities = array('d')
+
+    def __len__(self):
+        return len(self.days)
+
+    @property
+    def first_day(self):
+        return date.fromordinal(self.days[0]) if self.days else None
+
+    @property
+    def last_day(self):
+        return date.fromordinal(self.days[-1]) if self.days else None
+
+    def set(self, day, networth, assets, liabilities):
+        """Insert or replace the point of day. Returns True if the history changed."""
+        ordinal = day.toordinal()
+        i = bisect_left(self.days, ordinal)
+        values = (float(networth), float(assets), float(liabilities))
+        if i < len(self.days) and self.days[i] == ordinal:
+            if (self.networth[i], self.assets[i], self.liabilities[i]) == values:
+                return False
+            self.networth[i], self.assets[i], self.liabilities[i] = values
+            return True
+        self.days.insert(i, ordinal)
+        for column, value in zip(COLUMNS, values):
+            getattr(self, column).insert(i, value)
+        return True
+
+    def value_on(self, day):
+        """Return the networth of the last point on or before day, or None."""
+        i = bisect_right(self.days, day.toordinal())
+        return self.networth[i - 1] if i else None
+
+    def change(self, days, today, current):
+        """Return how much current differs from the net worth days ago, or None if that is before the history."""
+        if not self.days or self.days[0] > today.toordinal() - days:
+            return None
+        return current - self.value_on(date.fromordinal(today.toordinal() - days))
+
+    def downsample(self, today):
+        """
+        Keep only the latest point of each week or month once it is older
+        than DAILY_DAYS or WEEKLY_DAYS. Returns True if points were dropped.
+        """
+        today = today.toordinal()
+        keep = [
+            i for i in range(len(self.days))
+            if i + 1 == len(self.days) or _bucket(self.days[i], today) != _bucket(self.days[i + 1], today)
+        ]
+        if len(keep) == len(self.days):
+            return False
+        for column in ('days',) + COLUMNS:
+            values = getattr(self, column)
+            setattr(self, column, array(values.typecode, (values[i] for i in keep)))
+        return True
+
+    @classmethod
+    def load(cls, path):
+        """Return the history saved at path, or an empty one if there is none or it is unreadable."""
+        history = cls()
+        try:
+            with open(path, 'rb') as data_file:
+                data = data_file.read()
+        except IOError:
+            return history
+        try:
+            magic, version, count = HEADER.unpack_from(data)
+        except struct.error:
+            return history
+        if magic != MAGIC or version != VERSION:
+            return history
+        offset = HEADER.size
+        columns = {}
+        for column in ('days',) + COLUMNS:
+            values = array('i' if column == 'days' else 'd')
+            size = count * values.itemsize
+            if len(data) < offset + size:
+                return cls()
+            values.frombytes(data[offset:offset + size])
+            columns[column] = values
+            offset += size
+        for column, values in columns.items():
+            setattr(history, column, values)
+        return history
+
+    def save(self, path):
+        """Write the history to path, replacing it atomically."""
+        temporary = path + '.tmp'
+        with open(temporary, 'wb') as data_file:
+            data_file.write(HEADER.pack(MAGIC, VERSION, len(self.days)))
+            for column in ('days',) + COLUMNS:
+                data_file.write(getattr(self, column).tobytes())
+        os.replace(temporary, path)
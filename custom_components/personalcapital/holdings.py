@@ -0,0 +1,116 @@
+"""
+Investment holdings table for the Personal Capital sensors.
+
+Positions from getHoldings are summed per security across accounts and kept
+in parallel typed arrays, one row per security. Every row carries the table
+version it last changed in, so a sensor only has to rebuild the rows that
+changed since it last looked.
+"""
+
+from array import array
+
+COLUMNS = ('quantity', 'price', 'value', 'day_change')
+
+
+def security_key(holding):
+    """Return the key a holding is aggregated under: its ticker, else CUSIP, else description."""
+    return holding.get('ticker') or holding.get('cusip') or holding.get('description') or 'Unknown'
+
+
+class HoldingsTable(object):
+    """Array-backed table of positions keyed by security."""
+
+    __slots__ = ('keys', 'descriptions', 'quantity', 'price', 'value', 'day_change', 'versions', 'version', '_rows')
+
+    def __init__(self):
+        self.keys = []
+        self.descriptions = []
+        self.quantity = array('d')
+        self.price = array('d')
+        self.value = array('d')
+        self.day_change = array('d')
+        self.versions = array('q')
+        self.version = 0
+        self._rows = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self._rows
+
+    def row(self, key):
+        """Return {column: value} of a security."""
+        i = self._rows[key]
+        return {
+            'description': self.descriptions[i],
+            'quantity': self.quantity[i],
+            'price': self.price[i],
+            'value': self.value[i],
+            'day_change': self.day_change[i],
+        }
+
+    def total_value(self):
+        return sum(self.value)
+
+    def changed_since(self, version):
+        """Return the keys of the rows that changed after version."""
+        return [key for key, row_version in zip(self.keys, self.versions) if row_version > version]
+
+    def update(self, holdings):
+        """
+        Replace the positions with those of a getHoldings response. Only
+        rows whose values differ are written; securities no longer held
+        are removed. Returns True if anything changed.
+        """
+        totals = {}
+        for holding in holdings:
+            key = security_key(holding)
+            total = totals.get(key)
+            if total is None:
+                totals[key] = total = [holding.get('description') or key, 0.0, 0.0, 0.0, 0.0]
+            total[1] += holding.get('quantity') or 0.0
+            total[2] = holding.get('price') or total[2]
+            total[3] += holding.get('value') or 0.0
+            total[4] += holding.get('oneDayValueChange') or 0.0
+
+        version = self.version + 1
+        changed = self._remove([key for key in self.keys if key not in totals])
+        for key, (description, quantity, price, value, day_change) in totals.items():
+            i = self._rows.get(key)
+            if i is None:
+                self._rows[key] = len(self.keys)
+                self.keys.append(key)
+                self.descriptions.append(description)
+                self.quantity.append(quantity)
+                self.price.append(price)
+                self.value.append(value)
+                self.day_change.append(day_change)
+                self.versions.append(version)
+                changed = True
+            elif (self.quantity[i], self.price[i], self.value[i], self.day_change[i]) != (
+                    quantity, price, value, day_change) or self.descriptions[i] != description:
+                self.descriptions[i] = description
+                self.quantity[i] = quantity
+                self.price[i] = price
+                self.value[i] = value
+                self.day_change[i] = day_change
+                self.versions[i] = version
+                changed = True
+        if changed:
+            self.version = version
+        return changed
+
+    def _remove(self, keys):
+        """Drop the rows of keys, compacting the columns. Returns True if any were dropped."""
+        if not keys:
+            return False
+        gone = {self._rows[key] for key in keys}
+        keep = [i for i in range(len(self.keys)) if i not in gone]
+        self.keys = [self.keys[i] for i in keep]
+        self.descriptions = [self.descriptions[i] for i in keep]
+        for column in COLUMNS + ('versions',):
+            values = getattr(self, column)
+            setattr(self, column, array(values.typecode, (values[i] for i in keep)))
+        self._rows = {key: i for i, key in enumerate(self.keys)}
+        return True
@@ -0,0 +1,134 @@
+"""
+Incremental decoding of large personalcapital.com responses.
+
+Decodes one array inside a JSON document as the body streams in and hands
+each element to a callback, so the raw body and the full object tree are
+never held in memory together. Everything outside that array is decoded
+normally and returned.
+"""
+
+import codecs
+import json
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+_TERMINATORS = _WHITESPACE + ',]}'
+
+
+class _Reader(object):
+    """Pull parser over an async iterator of byte chunks."""
+
+    def __init__(self, chunks):
+        self._chunks = chunks.__aiter__()
+        self._text = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    async def _more(self):
+        if self._eof:
+            raise ValueError("Unexpected end of JSON document")
+        try:
+            chunk = await self._chunks.__anext__()
+            text = self._text.decode(chunk)
+        except StopAsyncIteration:
+            self._eof = True
+            text = self._text.decode(b'', final=True)
+        # drop what has been consumed so the buffer only ever holds the
+        # value being decoded plus one chunk
+        self._buffer = self._buffer[self._pos:] + text
+        self._pos = 0
+
+    async def peek(self):
+        """Return the next non-whitespace character without consuming it."""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            await self._more()
+
+    async def expect(self, *characters):
+        character = await self.peek()
+        if character not in characters:
+            raise ValueError(f"Expected {' or '.join(characters)} at {character!r}")
+        self._pos += 1
+        return character
+
+    async def value(self):
+        """Decode the next complete JSON value."""
+        await self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                if self._eof:
+                    raise
+                await self._more()
+                continue
+            if not self._eof and (end == len(self._buffer) or (
+                    isinstance(value, (int, float)) and self._buffer[end] not in _TERMINATORS)):
+                # a value ending with the buffer, or a number cut short inside
+                # its fraction or exponent, may continue in the next chunk
+                await self._more()
+                continue
+            self._pos = end
+            return value
+
+
+async def _object(reader, path, callback):
+    """Decode an object, streaming the array at path (relative to it)."""
+    result = {}
+    await reader.expect('{')
+    if await reader.peek() == '}':
+        await reader.expect('}')
+        return result
+    while True:
+        key = await reader.value()
+        await reader.expect(':')
+        if path and key == path[0]:
+            if len(path) == 1:
+                result[key] = await _array(reader, callback)
+            elif await reader.peek() == '{':
+                result[key] = await _object(reader, path[1:], callback)
+            else:
+                result[key] = await reader.value()
+        else:
+            result[key] = await reader.value()
+        if await reader.expect(',', '}') == '}':
+            return result
+
+
+async def _array(reader, callback):
+    """
+    Hand each element of an array to callback and return how many there
+    were. If callback returns an awaitable it is awaited before the next
+    element is decoded.
+    """
+    if await reader.peek() != '[':
+        return await reader.value()
+    await reader.expect('[')
+    count = 0
+    if await reader.peek() == ']':
+        await reader.expect(']')
+        return count
+    while True:
+        pending = callback(await reader.value())
+        if pending is not None:
+            await pending
+        count += 1
+        if await reader.expect(',', ']') == ']':
+            return count
+
+
+async def stream_array(chunks, path, callback):
+    """
+    Decode the JSON object read from the async iterator of byte chunks,
+    calling callback(element) for each element of the array found at path
+    (a tuple of keys, e.g. ('spData', 'transactions')). callback may be a
+    coroutine function, e.g. to write elements out in batches.
+
+    Returns the rest of the document, with that array replaced by the number
+    of elements it had.
+    """
+    return await _object(_Reader(chunks), tuple(path), callback)
@@ -0,0 +1,142 @@
+"""
+Long-term statistics for the Personal Capital sensors.
+
+The balance of every open account and the daily spending per category are
+imported into Home Assistant's long-term statistics as external statistics
+(personalcapital:...), in one batch per statistic. Years of history then
+live in the recorder's compact statistics tables instead of being repeated
+in the state attributes on every change.
+
+Spending is a sum statistic counted from an origin day, remembered in the
+transaction store, so every import continues the same running total. Each
+import only rewrites the days since the previous one, or since the start of
+the refreshed or backfilled transactions if that is earlier. Transactions
+backfilled before the origin move it back, and everything is rewritten.
+"""
+
+import json
+from datetime import date, timedelta
+
+from homeassistant.components.recorder.models import StatisticData, StatisticMetaData
+from homeassistant.components.recorder.statistics import async_add_external_statistics
+from homeassistant.util import dt as dt_util
+from homeassistant.util import slugify
+
+DOMAIN = 'personalcapital'
+
+META_ORIGIN = 'statistics_origin'
+META_IMPORTED = 'statistics_imported'
+META_CATEGORIES = 'statistics_categories'
+
+
+def statistic_id(login, kind, key):
+    """Return the id of an external statistic, e.g. personalcapital:partner_balance_1234."""
+    prefix = f'{slugify(login)}_' if login else ''
+    return f'{DOMAIN}:{prefix}{kind}_{slugify(str(key))}'
+
+
+def spending_series(store, start, end):
+    """
+    Return ({category id: (category name, [(day, amount, running total)])},
+    state) of the daily spending to import, state being what
+    save_spending_state records once it is imported.
+
+    The first import covers everything in the store but only the days with
+    spending. Later ones start at start or the day after the previous
+    import, whichever is earlier, and write every day of every category
+    imported so far, so days whose transactions were removed are corrected.
+    A start before the origin makes it the new origin.
+
+    Blocks; run it in the executor.
+    """
+    origin = (store.get_meta(META_ORIGIN) or store.first_date() or start.isoformat())[:10]
+    imported = store.get_meta(META_IMPORTED)
+    categories = {}
+    if imported:
+        if start.isoformat() < origin:
+            origin = start.isoformat()
+        start = max(min(start, date.fromisoformat(imported) + timedelta(days=1)), date.fromisoformat(origin))
+        categories = dict(json.loads(store.get_meta(META_CATEGORIES) or '[]'))
+    else:
+        start = date.fromisoformat(origin)
+
+    totals = {}
+    for category_id, category_name, amount in store.category_totals(
+            origin, (start - timedelta(days=1)).isoformat()):
+        categories[category_id] = category_name
+        totals[category_id] = totals.get(category_id, 0.0) + amount
+    days = {}
+    for day, category_id, category_name, amount in store.daily_category_totals(start.isoformat(), end.isoformat()):
+        categories[category_id] = category_name
+        day = date.fromisoformat(day[:10])
+        days[day, category_id] = days.get((day, category_id), 0.0) + amount
+
+    series = {}
+    for category_id, category_name in categories.items():
+        total = totals.get(category_id, 0.0)
+        points = []
+        for ordinal in range(start.toordinal(), end.toordinal() + 1):
+            day = date.fromordinal(ordinal)
+            amount = days.get((day, category_id))
+            if amount is None and not imported:
+                continue
+            total += amount or 0.0
+            points.append((day, round(amount or 0.0, 2), round(total, 2)))
+        if points:
+            series[category_id] = (category_name, points)
+    return series, (origin, end.isoformat(), sorted(categories.items(), key=lambda item: str(item[0])))
+
+
+def save_spending_state(store, state):
+    """Record the origin, last day and [(category id, name)] of an import. Blocks; run it in the executor."""
+    origin, imported, categories = state
+    store.set_meta(META_ORIGIN, origin)
+    store.set_meta(META_IMPORTED, imported)
+    store.set_meta(META_CATEGORIES, json.dumps(categories))
+
+
+class StatisticsImporter(object):
+    """Imports the long-term statistics of one login."""
+
+    def __init__(self, hass, name, unit_of_measurement):
+        self._hass = hass
+        self._name = name
+        self._unit_of_measurement = unit_of_measurement
+        self._prefix = f'PC {name} ' if name else 'PC '
+
+    def import_balances(self, accounts):
+        """Write the balance of each open account in a getAccounts response for the current hour."""
+        hour = dt_util.utcnow().replace(minute=0, second=0, microsecond=0)
+        for account in accounts:
+            if account.get('closeDate', '') != '':
+                continue
+            key = next((account[field] for field in ('userAccountId', 'accountId', 'name')
+                        if account.get(field) not in (None, '')), None)
+            if key is None:
+                continue
+            balance = account.get('balance') or 0.0
+            label = ' '.join(part for part in (account.get('firmName'), account.get('name')) if part)
+            self._import(statistic_id(self._name, 'balance', key), f'{self._prefix}{label} Balance', False, [
+                StatisticData(start=hour, state=balance, mean=balance, min=balance, max=balance)])
+
+    async def async_import_spending(self, store, start, end):
+        """Write the daily spending per category from start (or the previous import) to end."""
+        series, state = await self._hass.async_add_executor_job(spending_series, store, start, end)
+        for category_id, (category_name, points) in series.items():
+            self._import(
+                statistic_id(self._name, 'spending', 'uncategorized' if category_id is None else category_id),
+                f'{self._prefix}Spending {category_name or "Uncategorized"}', True, [
+                    StatisticData(start=dt_util.start_of_local_day(day), state=amount, sum=total)
+                    for day, amount, total in points
+                ])
+        await self._hass.async_add_executor_job(save_spending_state, store, state)
+
+    def _import(self, statistic, name, has_sum, statistics):
+        async_add_external_statistics(self._hass, StatisticMetaData(
+            has_mean=not has_sum,
+            has_sum=has_sum,
+            name=name,
+            source=DOMAIN,
+            statistic_id=statistic,
+            unit_of_measurement=self._unit_of_measurement,
+        ), statistics)
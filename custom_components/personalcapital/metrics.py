@@ -0,0 +1,142 @@
+"""
+Performance counters for the Personal Capital client and refreshes.
+
+Every request is recorded per endpoint (latency, bytes, errors) and every
+processing stage of a refresh (fetching, storing, aggregating, ...) per
+stage, keeping a rolling window of recent durations for the p50/p95.
+Hooks can be added to see each sample as it is recorded, and listeners are
+told when a refresh finishes.
+"""
+
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+
+ROLLING_SAMPLES = 100
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def percentile(samples, fraction):
+    """Return the nearest-rank percentile of samples, or None if there are none."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+class Stats(object):
+    """Rolling durations and byte counts of one endpoint or stage."""
+
+    __slots__ = ('count', 'errors', 'bytes', 'last_bytes', '_durations')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.bytes = 0
+        self.last_bytes = None
+        self._durations = deque(maxlen=ROLLING_SAMPLES)
+
+    def add(self, seconds, nbytes=None, ok=True):
+        self.count += 1
+        if not ok:
+            self.errors += 1
+        self._durations.append(seconds)
+        if nbytes is not None:
+            self.bytes += nbytes
+            self.last_bytes = nbytes
+
+    def as_dict(self):
+        """Return the counters with the p50/p95 in milliseconds, for state attributes."""
+        result = {
+            'count': self.count,
+            'p50_ms': _milliseconds(percentile(self._durations, 0.5)),
+            'p95_ms': _milliseconds(percentile(self._durations, 0.95)),
+        }
+        if self.errors:
+            result['errors'] = self.errors
+        if self.last_bytes is not None:
+            result['last_bytes'] = self.last_bytes
+            result['total_bytes'] = self.bytes
+        return result
+
+
+class PerformanceMetrics(object):
+    """Counters shared by a PersonalCapital client and its PersonalCapitalAccountData."""
+
+    def __init__(self):
+        self.endpoints = {}
+        self.stages = {}
+        self.relogins = 0
+        self.retries = 0
+        self.circuit_opens = 0
+        self.refreshes = 0
+        self.failed_refreshes = 0
+        self.last_refresh = None
+        self._hooks = []
+        self._listeners = []
+
+    def add_hook(self, hook):
+        """
+        Call hook(kind, name, seconds, nbytes) for every sample recorded from
+        now on, kind being 'endpoint', 'stage' or 'refresh'. Returns a
+        function that removes the hook.
+        """
+        self._hooks.append(hook)
+        return lambda: self._hooks.remove(hook)
+
+    def add_listener(self, listener):
+        """Call listener() after every refresh. Returns a function that removes it."""
+        self._listeners.append(listener)
+        return lambda: self._listeners.remove(listener)
+
+    def record_request(self, endpoint, seconds, nbytes=None, ok=True):
+        self.endpoints.setdefault(endpoint, Stats()).add(seconds, nbytes, ok)
+        self._call_hooks('endpoint', endpoint, seconds, nbytes)
+
+    def record_stage(self, stage, seconds):
+        self.stages.setdefault(stage, Stats()).add(seconds)
+        self._call_hooks('stage', stage, seconds, None)
+
+    @contextmanager
+    def stage(self, stage):
+        """Time the body of the with statement (awaits included) as stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage(stage, time.perf_counter() - start)
+
+    def record_refresh(self, seconds, ok=True):
+        self.refreshes += 1
+        if not ok:
+            self.failed_refreshes += 1
+        self.last_refresh = seconds
+        self._call_hooks('refresh', 'refresh', seconds, None)
+        for listener in list(self._listeners):
+            listener()
+
+    def as_dict(self):
+        """Return everything recorded so far, for state attributes."""
+        return {
+            'last_refresh_ms': _milliseconds(self.last_refresh),
+            'refreshes': self.refreshes,
+            'failed_refreshes': self.failed_refreshes,
+            'relogins': self.relogins,
+            'retries': self.retries,
+            'circuit_opens': self.circuit_opens,
+            'endpoints': {name: stats.as_dict() for name, stats in sorted(self.endpoints.items())},
+            'stages': {name: stats.as_dict() for name, stats in sorted(self.stages.items())},
+        }
+
+    def _call_hooks(self, kind, name, seconds, nbytes):
+        for hook in list(self._hooks):
+            try:
+                hook(kind, name, seconds, nbytes)
+            except Exception:
+                _LOGGER.exception("Performance hook %s failed", hook)
+
+
+def _milliseconds(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
@@ -5,29 +5,71 @@ For more details about this platform, please refer to the documentation at
 https://github.com/chotaling1/sensor.personalcapital
 """
 
+import asyncio
+import cProfile
+import gzip
+import io
 import logging
+import pstats
 import voluptuous as vol
+import itertools
 import json
+import math
+import os
 import time
-from datetime import timedelta, date, datetime
-from homeassistant.helpers.entity import Entity
+from abc import abstractmethod
+from collections import namedtuple
+from contextlib import asynccontextmanager
+from datetime import timedelta, date
+from types import MappingProxyType
+import aiohttp
+from yarl import URL
+from homeassistant.components import configurator
+from homeassistant.const import CONF_NAME, EVENT_HOMEASSISTANT_CLOSE, EVENT_HOMEASSISTANT_STOP, EntityCategory
 import homeassistant.helpers.config_validation as cv
 from homeassistant.components.sensor import (PLATFORM_SCHEMA)
-from homeassistant.util import Throttle
-import pandas
+from homeassistant.helpers.update_coordinator import (
+    CoordinatorEntity, DataUpdateCoordinator, UpdateFailed)
+from homeassistant.util import slugify
 import pickle
-import requests
 import re
 
+from .cassette import MODES as CASSETTE_MODES, REDACTED, Cassette
+from .history import NetWorthHistory
+from .holdings import HoldingsTable
+from .jsonstream import stream_array
+from .longterm import StatisticsImporter
+from .metrics import PerformanceMetrics
+from .spending import SpendingColumns
+from .store import TransactionStore, missing_ranges
+from .transport import (
+    ACCEPT_ENCODING, DEFAULT_TIMEOUT, RETRY_ATTEMPTS, RETRY_STATUSES, TRANSIENT_ERRORS,
+    CircuitBreaker, is_transient, retry_delay)
+
 __version__ = '0.1.1'
 
 CONF_EMAIL = 'email'
 CONF_PASSWORD = 'password'
 CONF_UNIT_OF_MEASUREMENT = 'unit_of_measurement'
 CONF_CATEGORIES = 'monitored_categories'
+CONF_CATEGORY_CACHE_TTL = 'category_cache_ttl'
+CONF_ACCOUNTS_INTERVAL = 'accounts_interval'
+CONF_TRANSACTIONS_INTERVAL = 'transactions_interval'
+CONF_BUDGET_PERIODS = 'budget_periods'
+CONF_PROFILE = 'profile'
+CONF_HOLDINGS = 'holdings'
+CONF_CASSETTE = 'cassette'
+CONF_STATISTICS = 'statistics'
 
 SESSION_FILE = '.pc-session'
+CATEGORIES_FILE = '.pc-categories'
+TRANSACTIONS_DB = '.pc-transactions{}.db'
+PROFILE_FILE = '.pc-profile{}.pstats'
+HISTORY_FILE = '.pc-networth{}.bin'
+SNAPSHOT_FILE = '.pc-snapshot{}.json.gz'
+CASSETTE_FILE = '.pc-cassette{}.jsonl.gz'
 DATA_PERSONAL_CAPITAL = 'personalcapital_cache'
+DATA_CONNECTOR = 'personalcapital_connector'
 
 ATTR_NETWORTH = 'networth'
 ATTR_ASSETS = 'assets'
@@ -40,9 +82,36 @@ ATTR_OTHER_LIABILITY = 'other_liability'
 ATTR_CREDIT = 'credit'
 ATTR_LOAN = 'loan'
 ATTR_BUDGET_SPENDING = "budget_spending"
+ATTR_HOLDINGS = 'holdings'
+ATTR_DAY_CHANGE = 'day_change'
 
-SCAN_INTERVAL = timedelta(minutes=5)
 MIN_TIME_BETWEEN_UPDATES = timedelta(minutes=30)
+MIN_REFRESH_INTERVAL = timedelta(minutes=5)
+MAX_REFRESH_BACKOFF = 4
+# the coordinator wakes up to a second before the time it was scheduled for
+DUE_TOLERANCE = 1
+TRANSACTION_SYNC_OVERLAP = timedelta(days=7)
+DEFAULT_CATEGORY_CACHE_TTL = timedelta(days=1)
+LOGIN_BACKOFF = timedelta(minutes=15)
+MAX_LOGIN_BACKOFF = timedelta(hours=8)
+MAX_CONCURRENT_REQUESTS = 4
+MAX_POOL_CONNECTIONS = 8
+KEEPALIVE_TIMEOUT = 60
+DNS_CACHE_TTL = 300
+STREAM_CHUNK_SIZE = 64 * 1024
+TRANSACTION_WINDOW = timedelta(days=31)
+MAX_PARALLEL_WINDOWS = 3
+WINDOW_RETRIES = 3
+TRANSACTIONS_PATH = ('spData', 'transactions')
+# transactions staged in the store at a time while a response streams in
+STORE_BATCH = 500
+HISTORY_BACKFILL = timedelta(days=3 * 365)
+NETWORTH_CHANGE_DAYS = (30, 90, 365)
+SNAPSHOT_VERSION = 1
+# the getAccounts fields the sensors read, all that is kept of each account in the saved snapshot
+SNAPSHOT_ACCOUNT_KEYS = (
+    'name', 'firmName', 'logoPath', 'balance', 'accountType', 'productType', 'homeUrl', 'currency',
+    'lastRefreshed', 'closeDate')
 
 SENSOR_TYPES = {
     ATTR_INVESTMENT: ['INVESTMENT', '', 'investmentAccountsTotal', 'Investment', False],
@@ -54,40 +123,107 @@ SENSOR_TYPES = {
     ATTR_LOAN: ['LOAN', '', 'loanAccountsTotal', 'Loan', True],
 }
 
+BUDGET_PERIODS = {
+    'month': '',
+    'week': 'Week',
+    'last_30_days': 'Last 30 Days',
+    'ytd': 'YTD',
+    'last_year': 'Last Year',
+    'last_3_years': 'Last 3 Years',
+}
+
 PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
+    vol.Optional(CONF_NAME): cv.string,
     vol.Required(CONF_EMAIL): cv.string,
     vol.Required(CONF_PASSWORD): cv.string,
     vol.Optional(CONF_UNIT_OF_MEASUREMENT, default='USD'): cv.string,
     vol.Optional(CONF_CATEGORIES, default=[]): vol.All(cv.ensure_list, [vol.In(SENSOR_TYPES)]),
+    vol.Optional(CONF_CATEGORY_CACHE_TTL, default=DEFAULT_CATEGORY_CACHE_TTL): cv.time_period,
+    vol.Optional(CONF_ACCOUNTS_INTERVAL, default=MIN_TIME_BETWEEN_UPDATES): cv.time_period,
+    vol.Optional(CONF_TRANSACTIONS_INTERVAL, default=MIN_TIME_BETWEEN_UPDATES): cv.time_period,
+    vol.Optional(CONF_BUDGET_PERIODS, default=['month']): vol.All(cv.ensure_list, [vol.In(BUDGET_PERIODS)]),
+    vol.Optional(CONF_PROFILE, default=False): cv.boolean,
+    vol.Optional(CONF_HOLDINGS, default=False): cv.boolean,
+    vol.Optional(CONF_CASSETTE): vol.In(CASSETTE_MODES),
+    vol.Optional(CONF_STATISTICS, default=True): cv.boolean,
 })
 
 _CONFIGURING = {}
+# the login whose refresh is being profiled; cProfile hooks the whole event
+# loop thread, so only one refresh in the process is profiled at a time
+_PROFILING = set()
 _LOGGER = logging.getLogger(__name__)
 
 
-def request_app_setup(hass, config, pc, add_devices, discovery_info=None):
+def login_suffix(config):
+    """
+    Return the suffix that keeps a named login's files, hass.data and
+    configurator request apart from the others ('' for an unnamed login).
+    """
+    name = config.get(CONF_NAME)
+    return f'-{slugify(name)}' if name else ''
+
+
+def sensor_name(name, label):
+    """Return the sensor name for label, including the login name if there is one."""
+    return f'PC {name} {label}' if name else f'PC {label}'
+
+
+def async_get_connector(hass):
+    """
+    Return the keep-alive connection pool shared by every login, creating it
+    on first use. Each login still has its own ClientSession and cookie jar.
+    """
+    connector = hass.data.get(DATA_CONNECTOR)
+    if connector is None:
+        connector = aiohttp.TCPConnector(
+            limit=MAX_POOL_CONNECTIONS, limit_per_host=MAX_POOL_CONNECTIONS,
+            keepalive_timeout=KEEPALIVE_TIMEOUT, ttl_dns_cache=DNS_CACHE_TTL)
+        hass.data[DATA_CONNECTOR] = connector
+
+        async def close_connector(event):
+            await connector.close()
+
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_CLOSE, close_connector)
+    return connector
+
+
+def async_create_login_session(hass):
+    """Return a ClientSession with its own cookie jar over the shared connection pool."""
+    session = aiohttp.ClientSession(
+        connector=async_get_connector(hass), connector_owner=False, cookie_jar=aiohttp.CookieJar())
+
+    async def close_session(event):
+        await session.close()
+
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_CLOSE, close_session)
+    return session
+
+
+async def async_request_app_setup(hass, config, pc, coordinator):
     """Request configuration steps from the user."""
-    configurator = hass.components.configurator
+    configuring = 'personalcapital' + login_suffix(config)
 
-    def personalcapital_configuration_callback(data):
+    async def personalcapital_configuration_callback(data):
         """Run when the configuration callback is called."""
-        pc.two_factor_authenticate(TwoFactorVerificationModeEnum.SMS, data.get('verification_code'))
-        result = pc.authenticate_password(config.get(CONF_PASSWORD))
+        await pc.two_factor_authenticate(TwoFactorVerificationModeEnum.SMS, data.get('verification_code'))
+        result = await pc.authenticate_password(config.get(CONF_PASSWORD))
 
-        if result == RequireTwoFactorException:
-            configurator.notify_errors(_CONFIGURING['personalcapital'], "Invalid verification code")
+        if getSpHeaderValue(result, SUCCESS_KEY) == False:
+            configurator.async_notify_errors(hass, _CONFIGURING[configuring], "Invalid verification code")
         else:
-            save_session(hass, pc.get_session())
-            continue_setup_platform(hass, config, pc, add_devices, discovery_info)
+            await async_save_session(hass, pc, login_suffix(config))
+            await async_continue_setup_platform(hass, config, pc, coordinator)
 
-    if 'personalcapital' not in _CONFIGURING:
+    if configuring not in _CONFIGURING:
         try:
-            pc.login(config.get(CONF_EMAIL), config.get(CONF_PASSWORD))
+            await pc.login(config.get(CONF_EMAIL), config.get(CONF_PASSWORD))
         except RequireTwoFactorException:
-            pc.two_factor_challenge(TwoFactorVerificationModeEnum.SMS)
+            await pc.two_factor_challenge(TwoFactorVerificationModeEnum.SMS)
 
-    _CONFIGURING['personalcapital'] = configurator.request_config(
-        'Personal Capital',
+    _CONFIGURING[configuring] = configurator.async_request_config(
+        hass,
+        f"Personal Capital ({config[CONF_NAME]})" if config.get(CONF_NAME) else 'Personal Capital',
         personalcapital_configuration_callback,
         description="Verification code sent to phone",
         submit_caption='Verify',
@@ -98,81 +234,274 @@ def request_app_setup(hass, config, pc, add_devices, discovery_info=None):
     )
 
 
-def load_session(hass):
+def load_session(hass, suffix=''):
+    """Return the saved {'csrf', 'cookies'}, or {} if there is none."""
     try:
-        with open(hass.config.path(SESSION_FILE)) as data_file:
-            cookies = {}
+        with open(hass.config.path(SESSION_FILE + suffix)) as data_file:
+            session = {}
             try:
-                cookies = json.load(data_file)
+                session = json.load(data_file)
             except ValueError as err:
                 return {}
-            return cookies
+            if not session:
+                return {}
+            if 'cookies' not in session:
+                # session files written before the csrf was saved hold only the cookies
+                return {'csrf': '', 'cookies': session}
+            return session
     except IOError as err:
         return {}
 
 
-def save_session(hass, session):
-    with open(hass.config.path(SESSION_FILE), 'w') as data_file:
+def save_session(hass, session, suffix=''):
+    with open(hass.config.path(SESSION_FILE + suffix), 'w') as data_file:
         data_file.write(json.dumps(session))
 
 
-def setup_platform(hass, config, add_devices, discovery_info=None):
-    """Set up the Personal Capital component."""
-    pc = PersonalCapital()
-    session = load_session(hass)
+async def async_save_session(hass, pc, suffix=''):
+    """Persist the client's csrf and cookies so a restart can resume the session."""
+    await hass.async_add_executor_job(
+        save_session, hass, {'csrf': pc.get_csrf(), 'cookies': pc.get_session()}, suffix)
 
-    if len(session) > 0:
-        pc.set_session(session)
 
-        try:
-            pc.login(config.get(CONF_EMAIL), config.get(CONF_PASSWORD))
-            continue_setup_platform(hass, config, pc, add_devices, discovery_info)
-        except RequireTwoFactorException:
-            request_app_setup(hass, config, pc, add_devices, discovery_info)
-    else:
-        request_app_setup(hass, config, pc, add_devices, discovery_info)
+def load_categories(hass, suffix=''):
+    """Return the cached (categories, fetched epoch), or ([], 0) if there is none."""
+    try:
+        with open(hass.config.path(CATEGORIES_FILE + suffix)) as data_file:
+            try:
+                cache = json.load(data_file)
+                return cache['categories'], cache['fetched']
+            except (ValueError, KeyError, TypeError) as err:
+                return [], 0
+    except IOError as err:
+        return [], 0
+
 
+def save_categories(hass, categories, fetched, suffix=''):
+    with open(hass.config.path(CATEGORIES_FILE + suffix), 'w') as data_file:
+        data_file.write(json.dumps({'categories': categories, 'fetched': fetched}))
+
+
+def load_snapshot(hass, suffix=''):
+    """Return the saved {'saved', 'accounts', 'budgets', 'networth_changes'}, or None if there is none."""
+    try:
+        with gzip.open(hass.config.path(SNAPSHOT_FILE.format(suffix)), 'rt') as data_file:
+            snapshot = json.load(data_file)
+    except (IOError, EOFError, ValueError) as err:
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get('version') != SNAPSHOT_VERSION:
+        return None
+    return snapshot
+
+
+def save_snapshot(hass, snapshot, suffix=''):
+    """Write the snapshot compressed, replacing the previous one atomically."""
+    path = hass.config.path(SNAPSHOT_FILE.format(suffix))
+    with gzip.open(path + '.tmp', 'wt') as data_file:
+        json.dump(dict(snapshot, version=SNAPSHOT_VERSION), data_file, separators=(',', ':'))
+    os.replace(path + '.tmp', path)
+
+
+async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
+    """
+    Set up the Personal Capital component. The sensors are added right away
+    from the snapshot saved before the last restart; logging in and the first
+    refresh run in the background so they do not hold up startup.
+    """
+    suffix = login_suffix(config)
+    logins = hass.data.setdefault(DATA_PERSONAL_CAPITAL, {})
+    if 'personalcapital' + suffix in logins:
+        _LOGGER.error("Personal Capital login %s is configured twice, give each login a unique name",
+                      config.get(CONF_NAME) or config.get(CONF_EMAIL))
+        return
+    logins['personalcapital' + suffix] = {}
+    try:
+        start_session = await _async_setup_login(hass, config, async_add_entities, suffix)
+    except Exception:
+        del logins['personalcapital' + suffix]
+        raise
+    if start_session is None:
+        # unregister it, so it holds no refresh slot and can be set up again
+        del logins['personalcapital' + suffix]
+        return
+    hass.async_create_background_task(start_session, f'personalcapital{suffix} login')
+
+
+async def _async_setup_login(hass, config, async_add_entities, suffix):
+    """
+    Add the sensors of a login and return the coroutine that starts its
+    session, or None if it can not be set up.
+    """
+    cassette = None
+    if config.get(CONF_CASSETTE):
+        cassette = Cassette(hass.config.path(CASSETTE_FILE.format(suffix)), config[CONF_CASSETTE])
+        if cassette.replaying:
+            try:
+                await hass.async_add_executor_job(cassette.load)
+            except (IOError, EOFError, ValueError, KeyError) as err:
+                _LOGGER.error("Unable to read the Personal Capital cassette %s: %s", cassette.path, err)
+                return None
 
-def continue_setup_platform(hass, config, pc, add_devices, discovery_info=None):
-    """Set up the Personal Capital component."""
-    if "personalcapital" in _CONFIGURING:
-        hass.components.configurator.request_done(_CONFIGURING.pop("personalcapital"))
+    pc = PersonalCapital(async_create_login_session(hass), cassette=cassette)
+    rest_pc = PersonalCapitalAccountData(hass, pc, config)
+    coordinator = PersonalCapitalCoordinator(hass, rest_pc)
+    if await rest_pc.async_restore():
+        _LOGGER.debug("Restored the personalcapital.com data saved before the restart")
+
+    async def close_store(event):
+        await rest_pc.async_close_store()
+
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, close_store)
 
-    rest_pc = PersonalCapitalAccountData(pc, config)
     uom = config[CONF_UNIT_OF_MEASUREMENT]
     sensors = []
     categories = config[CONF_CATEGORIES] if len(config[CONF_CATEGORIES]) > 0 else SENSOR_TYPES.keys()
-    sensors.append(PersonalCapitalNetWorthSensor(rest_pc, config[CONF_UNIT_OF_MEASUREMENT]))
-    sensors.append(PersonalCapitalBudgetSensor(rest_pc, hass, uom))
+    # the attributes whose history is in the long-term statistics are only
+    # left out of the recorder when the statistics are imported
+    if rest_pc.imports_statistics:
+        budget_sensor, category_sensor = PersonalCapitalBudgetStatisticsSensor, PersonalCapitalCategoryStatisticsSensor
+    else:
+        budget_sensor, category_sensor = PersonalCapitalBudgetSensor, PersonalCapitalCategorySensor
+    sensors.append(PersonalCapitalNetWorthSensor(coordinator, rest_pc, config[CONF_UNIT_OF_MEASUREMENT]))
+    for period in config.get(CONF_BUDGET_PERIODS, ['month']):
+        sensors.append(budget_sensor(coordinator, rest_pc, hass, uom, period))
     for category in categories:
-        sensors.append(PersonalCapitalCategorySensor(hass, rest_pc, uom, category))
-    add_devices(sensors, True)
+        sensors.append(category_sensor(coordinator, hass, rest_pc, uom, category))
+    if config.get(CONF_HOLDINGS):
+        sensors.append(PersonalCapitalHoldingsSensor(coordinator, rest_pc, uom))
+    sensors.append(PersonalCapitalDiagnosticSensor(coordinator, rest_pc))
+    async_add_entities(sensors)
+    return async_start_session(hass, config, pc, coordinator)
+
+
+async def async_start_session(hass, config, pc, coordinator):
+    """
+    Resume the saved personalcapital.com session or log in, then refresh.
+    Runs as a background task, so anything unexpected is logged here.
+    """
+    try:
+        await _async_start_session(hass, config, pc, coordinator)
+    except Exception:
+        _LOGGER.exception("Unable to start the personalcapital.com session")
+
+
+async def _async_start_session(hass, config, pc, coordinator):
+    suffix = login_suffix(config)
+    if pc.cassette is not None and pc.cassette.replaying:
+        # there is nothing to log in to
+        await async_continue_setup_platform(hass, config, pc, coordinator)
+        return
+    session = await hass.async_add_executor_job(load_session, hass, suffix)
+
+    if len(session) > 0:
+        pc.set_session(session['cookies'])
+        pc.set_csrf(session['csrf'])
+
+        try:
+            if await pc.resume_session():
+                _LOGGER.debug("Resumed the saved personalcapital.com session")
+            else:
+                await pc.login(config.get(CONF_EMAIL), config.get(CONF_PASSWORD))
+                await async_save_session(hass, pc, suffix)
+        except RequireTwoFactorException:
+            await async_request_app_setup(hass, config, pc, coordinator)
+            return
+        except (aiohttp.ClientError, asyncio.TimeoutError, LoginFailedException) as err:
+            # the refresh logs in again itself, with backoff
+            _LOGGER.warning("Unable to log in to personalcapital.com, retrying with the next refresh: %s", err)
+        await async_continue_setup_platform(hass, config, pc, coordinator)
+    else:
+        await async_request_app_setup(hass, config, pc, coordinator)
+
+
+async def async_continue_setup_platform(hass, config, pc, coordinator):
+    """Finish setting up once logged in: let the refreshes through and run the first one."""
+    configuring = 'personalcapital' + login_suffix(config)
+    if configuring in _CONFIGURING:
+        configurator.async_request_done(hass, _CONFIGURING.pop(configuring))
+
+    coordinator.rest.login_done.set()
+    await coordinator.async_refresh()
 
 
-class PersonalCapitalNetWorthSensor(Entity):
+class PersonalCapitalEntity(CoordinatorEntity):
+    """
+    Base for the sensors: a refresh only rebuilds the state and writes it
+    when the fingerprint of what the sensor shows has changed.
+    """
+
+    def __init__(self, coordinator):
+        super().__init__(coordinator)
+        self._fingerprint = None
+        self._was_available = None
+
+    def _handle_coordinator_update(self):
+        """Handle a refresh pushed by the coordinator."""
+        if not self._refresh() and self.available == self._was_available:
+            return
+        self._was_available = self.available
+        super()._handle_coordinator_update()
+
+    @property
+    def assumed_state(self):
+        """Return True while the state is the one saved before the last restart."""
+        return self._rest.stale
+
+    def _refresh(self):
+        """Rebuild the state if the fingerprint changed and return whether it did."""
+        fingerprint = self._state_fingerprint()
+        if fingerprint is None:
+            return False
+        fingerprint = (fingerprint, self.assumed_state)
+        if fingerprint == self._fingerprint:
+            return False
+        self._fingerprint = fingerprint
+        self._update_state()
+        return True
+
+    @abstractmethod
+    def _state_fingerprint(self):
+        """Return a hash of the data the sensor shows, or None if there is none yet."""
+
+    @abstractmethod
+    def _update_state(self):
+        """Rebuild the state and attributes from the data the fingerprint covers."""
+
+
+class PersonalCapitalNetWorthSensor(PersonalCapitalEntity):
     """Representation of a personalcapital.com net worth sensor."""
 
-    def __init__(self, rest, unit_of_measurement):
+    def __init__(self, coordinator, rest, unit_of_measurement):
         """Initialize the sensor."""
+        super().__init__(coordinator)
         self._rest = rest
         self._unit_of_measurement = unit_of_measurement
         self._state = None
         self._assets = None
         self._liabilities = None
-        self.update()
-
-    def update(self):
+        self._changes = {}
+        self._refresh()
+
+    def _state_fingerprint(self):
+        snapshot = self._rest.snapshot
+        if snapshot is None:
+            return None
+        data = snapshot.data
+        return hash((data.get('networth'), data.get('assets'), data.get('liabilities'),
+                     tuple(self._rest.networth_changes.items())))
+
+    def _update_state(self):
         """Get the latest state of the sensor."""
-        self._rest.update()
-        data = self._rest.data.json()['spData']
+        data = self._rest.snapshot.data
         self._state = data.get('networth', 0.0)
         self._assets = data.get('assets', 0.0)
         self._liabilities = format_balance(True, data.get('liabilities', 0.0))
+        self._changes = dict(self._rest.networth_changes)
 
     @property
     def name(self):
         """Return the name of the sensor."""
-        return 'PC Networth'
+        return sensor_name(self._rest.name, 'Networth')
 
     @property
     def state(self):
@@ -196,37 +525,50 @@ class PersonalCapitalNetWorthSensor(Entity):
             ATTR_ASSETS: self._assets,
             ATTR_LIABILITIES: self._liabilities
         }
+        for days, change in self._changes.items():
+            attributes[f'change_{days}d'] = change
         return attributes
 
-class PersonalCapitalBudgetSensor(Entity):
-    """Representation a monthly spending from personalcapital.com sensor."""
+class PersonalCapitalBudgetSensor(PersonalCapitalEntity):
+    """Representation a spending from personalcapital.com sensor for one of BUDGET_PERIODS."""
 
-    def __init__(self, rest, hass, unit_of_measurement):
+    def __init__(self, coordinator, rest, hass, unit_of_measurement, period='month'):
+        super().__init__(coordinator)
         self.hass = hass
         self._rest = rest
         self._unit_of_measurement = unit_of_measurement
+        self._period = period
+        self._data_key = 'budget' if period == 'month' else f'budget_{period}'
+        self._name = sensor_name(rest.name, f'Budget {BUDGET_PERIODS[period]}'.strip())
         self._state = None
+        self._rest.data[self._data_key] = {'spendCategories':[]}
+        self._refresh()
+
+    def _state_fingerprint(self):
+        transactionCategories = self._rest.budget(self._period)
+        if transactionCategories is None:
+            return None
+        return hash(tuple((category['name'], category['amount']) for category in transactionCategories))
 
-    def update(self):
+    def _update_state(self):
         """Get the latest state of the sensor."""
-        self._rest.update()
-        self.hass.data["budget"] = {'spendCategories':[]}
-        transactionCategories = self._rest.transactions
-        for i in transactionCategories.index:
-            print('Amount spent in ' + transactionCategories['name'][i] + ':', transactionCategories['amount'][i], "\n\n")
-            self.hass.data['budget'].get('spendCategories').append(
+        self._rest.data[self._data_key] = {'spendCategories':[]}
+        transactionCategories = self._rest.budget(self._period)
+        for category in transactionCategories:
+            _LOGGER.debug('Amount spent in %s: %s', category['name'], category['amount'])
+            self._rest.data[self._data_key].get('spendCategories').append(
                 {
-                    'name': transactionCategories['name'][i],
-                    'amount': transactionCategories['amount'][i]
+                    'name': category['name'],
+                    'amount': category['amount']
                 }
             )
         
-        self._state = format_balance(False, transactionCategories['amount'].sum())
+        self._state = format_balance(False, sum(category['amount'] for category in transactionCategories))
 
     @property
     def name(self):
         """Return the name of the sensor."""
-        return 'PC Budget'
+        return self._name
 
     @property
     def state(self):
@@ -247,46 +589,60 @@ class PersonalCapitalBudgetSensor(Entity):
     def extra_state_attributes(self):
         """Return the state attributes of the sensor."""
         attributes = {
-            ATTR_BUDGET_SPENDING: self.hass.data['budget']
+            ATTR_BUDGET_SPENDING: self._rest.data[self._data_key]
         }
         
         return attributes
 
-class PersonalCapitalCategorySensor(Entity):
+
+class PersonalCapitalBudgetStatisticsSensor(PersonalCapitalBudgetSensor):
+    """A budget sensor of a login whose daily spending is imported as long-term statistics."""
+
+    # the history of the category totals is in the long-term statistics
+    _unrecorded_attributes = frozenset({ATTR_BUDGET_SPENDING})
+
+
+class PersonalCapitalCategorySensor(PersonalCapitalEntity):
     """Representation of a personalcapital.com sensor."""
 
-    def __init__(self, hass, rest, unit_of_measurement, sensor_type):
+    def __init__(self, coordinator, hass, rest, unit_of_measurement, sensor_type):
         """Initialize the sensor."""
+        super().__init__(coordinator)
         self.hass = hass
         self._rest = rest
+        self._sensor_type = sensor_type
         self._productType = SENSOR_TYPES[sensor_type][0]
-        self._accountType = SENSOR_TYPES[sensor_type][1]
         self._balanceName = SENSOR_TYPES[sensor_type][2]
-        self._name = f'PC {SENSOR_TYPES[sensor_type][3]}'
+        self._name = sensor_name(rest.name, SENSOR_TYPES[sensor_type][3])
         self._inverse_sign = SENSOR_TYPES[sensor_type][4]
         self._state = None
         self._unit_of_measurement = unit_of_measurement
+        self._rest.data[self._productType] = {'accounts': []}
+        self._refresh()
+
+    def _state_fingerprint(self):
+        snapshot = self._rest.snapshot
+        if snapshot is None:
+            return None
+        return hash((snapshot.data.get(self._balanceName), snapshot.accounts(self._sensor_type)))
 
-    def update(self):
+    def _update_state(self):
         """Get the latest state of the sensor."""
-        self._rest.update()
-        data = self._rest.data.json()['spData']
-        self._state = format_balance(self._inverse_sign, data.get(self._balanceName, 0.0))
-        accounts = data.get('accounts')
-        self.hass.data[self._productType] = {'accounts': []}
-
-        for account in accounts:
-            if ((self._productType == account.get('productType')) or (self._accountType == account.get('accountType', ''))) and account.get('closeDate', '') == '':
-                self.hass.data[self._productType].get('accounts').append({
-                    "name": account.get('name', ''),
-                    "firm_name": account.get('firmName', ''),
-                    "logo": account.get('logoPath', ''),
-                    "balance": format_balance(self._inverse_sign, account.get('balance', 0.0)),
-                    "account_type": account.get('accountType', ''),
-                    "url": account.get('homeUrl', ''),
-                    "currency": account.get('currency', ''),
-                    "refreshed": how_long_ago(account.get('lastRefreshed', 0)) + ' ago',
-                })
+        snapshot = self._rest.snapshot
+        self._state = format_balance(self._inverse_sign, snapshot.data.get(self._balanceName, 0.0))
+        self._rest.data[self._productType] = {'accounts': []}
+
+        for account in snapshot.accounts(self._sensor_type):
+            self._rest.data[self._productType].get('accounts').append({
+                "name": account.name,
+                "firm_name": account.firm_name,
+                "logo": account.logo,
+                "balance": format_balance(self._inverse_sign, account.balance),
+                "account_type": account.account_type,
+                "url": account.url,
+                "currency": account.currency,
+                "refreshed": how_long_ago(account.last_refreshed) + ' ago',
+            })
 
     @property
     def name(self):
@@ -311,79 +667,998 @@ class PersonalCapitalCategorySensor(Entity):
     @property
     def extra_state_attributes(self):
         """Return the state attributes of the sensor."""
-        return self.hass.data[self._productType]
+        return self._rest.data[self._productType]
+
+
+class PersonalCapitalCategoryStatisticsSensor(PersonalCapitalCategorySensor):
+    """A category sensor of a login whose account balances are imported as long-term statistics."""
+
+    # the history of the account balances is in the long-term statistics
+    _unrecorded_attributes = frozenset({'accounts'})
+
+
+class PersonalCapitalHoldingsSensor(PersonalCapitalEntity):
+    """
+    Total value of the investment holdings, with the position in each
+    security as attributes. Only the securities that changed since the
+    previous update are rebuilt.
+    """
+
+    _unrecorded_attributes = frozenset({ATTR_HOLDINGS})
+
+    def __init__(self, coordinator, rest, unit_of_measurement):
+        super().__init__(coordinator)
+        self._rest = rest
+        self._unit_of_measurement = unit_of_measurement
+        self._name = sensor_name(rest.name, 'Holdings')
+        self._state = None
+        self._day_change = None
+        self._holdings = {}
+        self._version = 0
+        self._refresh()
+
+    def _state_fingerprint(self):
+        holdings = self._rest.holdings
+        return None if holdings is None or not holdings.version else holdings.version
+
+    def _update_state(self):
+        """Get the latest state of the sensor."""
+        holdings = self._rest.holdings
+        # a new mapping, as the previous state still refers to the old one
+        rows = {key: row for key, row in self._holdings.items() if key in holdings}
+        for key in holdings.changed_since(self._version):
+            rows[key] = holdings.row(key)
+        self._holdings = rows
+        self._version = holdings.version
+        self._state = round(holdings.total_value(), 2)
+        self._day_change = round(sum(holdings.day_change), 2)
+
+    @property
+    def name(self):
+        """Return the name of the sensor."""
+        return self._name
+
+    @property
+    def state(self):
+        """Return the state of the sensor."""
+        return self._state
+
+    @property
+    def unit_of_measurement(self):
+        """Return the unit of measurement this sensor expresses itself in."""
+        return self._unit_of_measurement
+
+    @property
+    def icon(self):
+        """Return the icon to use in the frontend."""
+        return 'mdi:chart-line'
+
+    @property
+    def extra_state_attributes(self):
+        """Return the state attributes of the sensor."""
+        return {
+            ATTR_DAY_CHANGE: self._day_change,
+            ATTR_HOLDINGS: self._holdings,
+        }
+
+
+class PersonalCapitalDiagnosticSensor(PersonalCapitalEntity):
+    """
+    Duration of the last refresh, with the request and processing stage
+    timings, payload sizes and re-login count as attributes.
+    """
+
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    _unrecorded_attributes = frozenset({'endpoints', 'stages'})
+
+    def __init__(self, coordinator, rest):
+        super().__init__(coordinator)
+        self._rest = rest
+        self._name = sensor_name(rest.name, 'Refresh')
+        self._state = None
+        self._attributes = {}
+        self._refresh()
+
+    async def async_added_to_hass(self):
+        """Also update after refreshes that did not change any data."""
+        await super().async_added_to_hass()
+        self.async_on_remove(self._rest.metrics.add_listener(self._handle_metrics))
+
+    def _handle_metrics(self):
+        if self._refresh():
+            self.async_write_ha_state()
+
+    @property
+    def assumed_state(self):
+        """The timings are never restored, so they are never stale."""
+        return False
+
+    def _state_fingerprint(self):
+        metrics = self._rest.metrics
+        return metrics.refreshes or None
+
+    def _update_state(self):
+        attributes = self._rest.metrics.as_dict()
+        self._state = attributes.pop('last_refresh_ms')
+        self._attributes = attributes
+
+    @property
+    def name(self):
+        """Return the name of the sensor."""
+        return self._name
+
+    @property
+    def state(self):
+        """Return the state of the sensor."""
+        return self._state
+
+    @property
+    def unit_of_measurement(self):
+        """Return the unit of measurement this sensor expresses itself in."""
+        return 'ms'
+
+    @property
+    def icon(self):
+        """Return the icon to use in the frontend."""
+        return 'mdi:timer-outline'
+
+    @property
+    def extra_state_attributes(self):
+        """Return the state attributes of the sensor."""
+        return self._attributes
+
+
+AccountRecord = namedtuple('AccountRecord', [
+    'name', 'firm_name', 'logo', 'balance', 'account_type', 'url', 'currency', 'last_refreshed'])
+
+
+def index_accounts(accounts):
+    """
+    Return {SENSOR_TYPES key: (AccountRecord, ...)} of the open accounts in
+    one pass. An account belongs to every category whose productType or
+    accountType it matches.
+    """
+    by_product = {}
+    by_account_type = {}
+    for key, sensor_type in SENSOR_TYPES.items():
+        by_product.setdefault(sensor_type[0], []).append(key)
+        by_account_type.setdefault(sensor_type[1], []).append(key)
+
+    index = {key: [] for key in SENSOR_TYPES}
+    for account in accounts:
+        if account.get('closeDate', '') != '':
+            continue
+        keys = set(by_product.get(account.get('productType'), ()))
+        keys.update(by_account_type.get(account.get('accountType', ''), ()))
+        if not keys:
+            continue
+        record = AccountRecord(
+            account.get('name', ''),
+            account.get('firmName', ''),
+            account.get('logoPath', ''),
+            account.get('balance', 0.0),
+            account.get('accountType', ''),
+            account.get('homeUrl', ''),
+            account.get('currency', ''),
+            account.get('lastRefreshed', 0),
+        )
+        for key in keys:
+            index[key].append(record)
+    return {key: tuple(records) for key, records in index.items()}
+
+
+class PersonalCapitalSnapshot(object):
+    """Immutable, parsed getAccounts response shared by all sensors."""
+
+    __slots__ = ('_generation', '_data', '_accounts')
+
+    def __init__(self, generation, data):
+        self._generation = generation
+        self._data = MappingProxyType(data)
+        self._accounts = index_accounts(data.get('accounts') or [])
+
+    def accounts(self, sensor_type):
+        """Return the open accounts of a SENSOR_TYPES category, in response order."""
+        return self._accounts.get(sensor_type, ())
+
+    @property
+    def generation(self):
+        """Return the fetch number this snapshot was built from."""
+        return self._generation
+
+    @property
+    def data(self):
+        """Return the read-only spData of the getAccounts response."""
+        return self._data
+
+
+class PersonalCapitalCoordinator(DataUpdateCoordinator):
+    """Coordinator that wakes up when the next personalcapital.com request is due."""
+
+    def __init__(self, hass, rest):
+        super().__init__(
+            hass,
+            _LOGGER,
+            name='personalcapital' + rest.suffix,
+            update_interval=MIN_REFRESH_INTERVAL,
+            always_update=False,
+        )
+        self.rest = rest
+
+    async def _async_update_data(self):
+        """Refresh whatever is due; entities are only notified if the data changed."""
+        try:
+            return await self.rest.async_update()
+        finally:
+            self.update_interval = self.rest.next_refresh()
+
+
+class RefreshSchedule(object):
+    """Adaptive polling interval for one kind of request."""
+
+    __slots__ = ('_base', '_interval', '_phase', 'due')
+
+    def __init__(self, base, phase=None):
+        self._base = base
+        self._interval = base
+        # returns the offset in seconds of this schedule's slots, which moves as logins come and go
+        self._phase = phase or (lambda: 0)
+        self.due = 0
+
+    def is_due(self, now):
+        return now + DUE_TOLERANCE >= self.due
+
+    def done(self, now, changed, active=False):
+        """
+        Schedule the next request: poll faster while the accounts are being
+        refreshed upstream, return to the base interval when data changed and
+        back off while it stays the same.
+        """
+        if active:
+            self._interval = max(self._base / 2, MIN_REFRESH_INTERVAL)
+        elif changed:
+            self._interval = self._base
+        else:
+            self._interval = min(self._interval * 2, self._base * MAX_REFRESH_BACKOFF)
+        self.due = self._align(now + self._interval.total_seconds())
+
+    def hurry(self, now):
+        """Bring the next request forward to the fast interval."""
+        self._interval = max(self._base / 2, MIN_REFRESH_INTERVAL)
+        self.due = min(self.due, self._align(now + self._interval.total_seconds()))
+
+    def _align(self, due):
+        """
+        Round due up to this schedule's slot, so logins with different phases
+        never poll in the same minute.
+        """
+        slot = MIN_REFRESH_INTERVAL.total_seconds()
+        phase = self._phase()
+        return math.ceil((due - phase) / slot) * slot + phase
+
+
+RefreshResult = namedtuple('RefreshResult', ['accounts', 'start_date', 'transactions', 'window', 'categories', 'holdings'])
+
+
+def transaction_fingerprint(transaction):
+    """Return the (date, digest) a transaction is compared by between refreshes."""
+    return transaction.get('transactionDate', ''), hash(json.dumps(transaction, sort_keys=True))
+
+
+class TransactionSink(object):
+    """
+    Receives the transactions of one getUserTransactions response as they
+    stream in and stages them in the transaction store STORE_BATCH at a
+    time, so no more than one batch is held in memory. Only the fingerprint
+    and the category ids of each transaction are kept, to tell whether the
+    window changed and which categories it refers to.
+    """
+
+    def __init__(self, hass, store, batch):
+        self._hass = hass
+        self._store = store
+        self._batch = batch
+        self._pending = []
+        self._done = False
+        self.fingerprints = {}
+        self.category_ids = set()
+
+    async def add(self, transaction):
+        """Stream callback: fingerprint a transaction and stage it."""
+        self.fingerprints[str(transaction.get('userTransactionId'))] = transaction_fingerprint(transaction)
+        self.category_ids.update(
+            row['categoryId'] for row in (transaction.get('splits') or [transaction])
+            if row.get('categoryId') is not None)
+        self._pending.append(transaction)
+        if len(self._pending) >= STORE_BATCH:
+            await self._async_flush()
+
+    async def _async_flush(self):
+        pending, self._pending = self._pending, []
+        if pending:
+            await self._hass.async_add_executor_job(self._store.stage, self._batch, pending)
+
+    async def async_commit(self, start_date, end_date):
+        """Replace the stored start_date..end_date window with everything received."""
+        await self._async_flush()
+        await self._hass.async_add_executor_job(self._store.commit_window, self._batch, start_date, end_date)
+        self._done = True
+
+    async def async_discard(self):
+        """Drop what was staged, unless it was committed."""
+        if self._done:
+            return
+        self._done = True
+        self._pending = []
+        await self._hass.async_add_executor_job(self._store.discard, self._batch)
 
 
 class PersonalCapitalAccountData(object):
     """Get data from personalcapital.com"""
 
-    def __init__(self, pc, config):
+    def __init__(self, hass, pc, config):
+        self._hass = hass
         self._pc = pc
-        self.data = None
-        self.transactions = None
+        self.metrics = pc.metrics
+        self.name = config.get(CONF_NAME)
+        self.suffix = login_suffix(config)
+        logins = hass.data.setdefault(DATA_PERSONAL_CAPITAL, {})
+        self.data = logins.setdefault('personalcapital' + self.suffix, {})
+        self.snapshot = None
+        self.budgets = None
+        self.networth_changes = {}
+        self.stale = False
+        # set once the background login is done, or has given up to the refresh's own
+        self.login_done = asyncio.Event()
+        self.holdings = HoldingsTable() if config.get(CONF_HOLDINGS) else None
+        self._statistics = None
+        if config.get(CONF_STATISTICS) and 'recorder' in hass.config.components:
+            self._statistics = StatisticsImporter(hass, self.name, config.get(CONF_UNIT_OF_MEASUREMENT, 'USD'))
         self._config = config
+        self._budget_periods = set(config.get(CONF_BUDGET_PERIODS, ['month'])) | {'month'}
+        self._budgets_day = None
+        self._generation = 0
+        self._fingerprints = {}
+        self._category_ids = set()
+        self._batches = itertools.count(1)
+        self._transactions_synced = None
+        self._transactions_change_id = None
+        self._categories = None
+        self._categories_fetched = 0
+        self._categories_missing = set()
+        self._store = None
+        self._spending = None
+        self._history = None
+        self._history_checked = None
+        self._login_failures = 0
+        self._next_login = 0
+        self._last_refreshed = None
+        self._saved = None
+        self._accounts_schedule = RefreshSchedule(
+            config.get(CONF_ACCOUNTS_INTERVAL, MIN_TIME_BETWEEN_UPDATES), self._phase)
+        self._transactions_schedule = RefreshSchedule(
+            config.get(CONF_TRANSACTIONS_INTERVAL, MIN_TIME_BETWEEN_UPDATES), self._phase)
+
+    def _phase(self):
+        """
+        Return the offset in seconds of this login's refresh slots: the logins
+        set up are spread evenly over a slot, in the order they were set up.
+        """
+        logins = list(self._hass.data.get(DATA_PERSONAL_CAPITAL, {}))
+        key = 'personalcapital' + self.suffix
+        if key not in logins:
+            return 0
+        return logins.index(key) * MIN_REFRESH_INTERVAL.total_seconds() / len(logins)
 
-    @Throttle(MIN_TIME_BETWEEN_UPDATES)
-    def update(self):
+    async def async_restore(self):
+        """
+        Show the snapshot saved before the last restart until the first
+        refresh succeeds. Returns True if there was one.
+        """
+        saved = await self._hass.async_add_executor_job(load_snapshot, self._hass, self.suffix)
+        if saved is None:
+            return False
+        try:
+            self.snapshot = PersonalCapitalSnapshot(0, saved['accounts'])
+            self.budgets = saved['budgets']
+            self.networth_changes = {int(days): change for days, change in saved['networth_changes'].items()}
+        except (KeyError, TypeError, ValueError, AttributeError) as err:
+            _LOGGER.debug("Ignoring the unreadable saved snapshot: %s", err)
+            self.snapshot, self.budgets, self.networth_changes = None, None, {}
+            return False
+        self.stale = True
+        self._saved = self._snapshot_key()
+        return True
+
+    @property
+    def imports_statistics(self):
+        """Return whether the balances and spending are imported as long-term statistics."""
+        return self._statistics is not None
+
+    def _snapshot_key(self):
+        return self.snapshot.generation, self.budgets, self.networth_changes
+
+    async def _async_save_snapshot(self):
+        """Persist what the sensors show, if it changed since it was last saved."""
+        if self.snapshot is None or self._snapshot_key() == self._saved:
+            return
+        data = self.snapshot.data
+        totals = (ATTR_NETWORTH, ATTR_ASSETS, ATTR_LIABILITIES) + tuple(
+            sensor_type[2] for sensor_type in SENSOR_TYPES.values())
+        accounts = {key: data[key] for key in totals if key in data}
+        accounts['accounts'] = [
+            {key: account[key] for key in SNAPSHOT_ACCOUNT_KEYS if key in account}
+            for account in data.get('accounts') or []
+        ]
+        snapshot = {
+            'saved': time.time(),
+            'accounts': accounts,
+            'budgets': self.budgets,
+            'networth_changes': self.networth_changes,
+        }
+        try:
+            await self._hass.async_add_executor_job(save_snapshot, self._hass, snapshot, self.suffix)
+        except OSError as err:
+            _LOGGER.warning("Unable to save the personalcapital.com snapshot: %s", err)
+            return
+        self._saved = self._snapshot_key()
+
+    def next_refresh(self):
+        """Return how long until the next request is due."""
+        due = min(self._accounts_schedule.due, self._transactions_schedule.due) - time.time()
+        if due <= 0:
+            # overdue, the refresh failed or was held back: try again at the fast interval
+            return MIN_REFRESH_INTERVAL
+        return timedelta(seconds=max(due, DUE_TOLERANCE))
+
+    async def async_update(self):
         """Get latest data from personal capital"""
-        self.data = self._pc.fetch('/newaccount/getAccounts')
+        if not self.login_done.is_set():
+            # logging in, or waiting for the 2FA code, in the background
+            if self.snapshot is not None:
+                return self._data()
+            raise UpdateFailed("Waiting for the personalcapital.com login to finish")
+        profiler = None
+        if self._config.get(CONF_PROFILE):
+            if _PROFILING:
+                _LOGGER.debug("Not profiling this refresh, the refresh of %s is being profiled", *_PROFILING)
+            else:
+                _PROFILING.add('personalcapital' + self.suffix)
+                profiler = cProfile.Profile()
+        start = time.perf_counter()
+        ok = False
+        if profiler is not None:
+            profiler.enable()
+        try:
+            result = await self._async_update()
+            ok = True
+            return result
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                _PROFILING.clear()
+                await self._hass.async_add_executor_job(self._save_profile, profiler)
+            self.metrics.record_refresh(time.perf_counter() - start, ok)
+            cassette = self._pc.cassette
+            if cassette is not None and cassette.dirty:
+                try:
+                    await self._hass.async_add_executor_job(cassette.save)
+                except OSError as err:
+                    _LOGGER.warning("Unable to save the personalcapital.com cassette: %s", err)
+
+    def _save_profile(self, profiler):
+        """
+        Write the refresh profile next to the session file and log the top
+        functions. The profile covers the event loop thread from the start of
+        the refresh to its end, awaits included, so whatever else Home
+        Assistant ran on the loop meanwhile shows up in it too.
+        """
+        profiler.dump_stats(self._hass.config.path(PROFILE_FILE.format(self.suffix)))
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(20)
+        _LOGGER.debug("Refresh profile:\n%s", report.getvalue())
+
+    async def _async_update(self):
+        result = None
+        try:
+            if self._store is None:
+                await self._async_open_store()
+            if self._categories is None:
+                self._categories, self._categories_fetched = await self._hass.async_add_executor_job(
+                    load_categories, self._hass, self.suffix)
+
+            with self.metrics.stage('fetch'):
+                result = await self._async_fetch()
+
+            if not self._successful(result):
+                if result.window is not None:
+                    await result.window.async_discard()
+                with self.metrics.stage('login'):
+                    await self._async_login()
+                with self.metrics.stage('fetch'):
+                    result = await self._async_fetch()
+
+            if result.accounts is not None and not getSpHeaderValue(result.accounts, SUCCESS_KEY):
+                raise UpdateFailed(getErrorValue(result.accounts) or "getAccounts was not successful")
+            if result.transactions is not None and not getSpHeaderValue(result.transactions, SUCCESS_KEY):
+                raise UpdateFailed(getErrorValue(result.transactions) or "getUserTransactions was not successful")
+
+            now = time.time()
+            if result.accounts is not None:
+                with self.metrics.stage('accounts'):
+                    self._apply_accounts(now, result.accounts.get('spData') or {})
+                with self.metrics.stage('history'):
+                    await self._async_update_history()
+            if result.holdings is not None:
+                if getSpHeaderValue(result.holdings, SUCCESS_KEY):
+                    with self.metrics.stage('holdings'):
+                        self.holdings.update((result.holdings.get('spData') or {}).get('holdings') or [])
+                else:
+                    _LOGGER.debug("getHoldings failed: %s", getErrorValue(result.holdings))
+
+            changed = False
+            today = date.today()
+            if result.transactions is not None:
+                with self.metrics.stage('transactions'):
+                    changed = self._apply_transactions(result.start_date, result.window)
+                self._transactions_change_id = getServerChangeId(result.transactions)
+                self._transactions_schedule.done(now, changed)
+                with self.metrics.stage('store'):
+                    if changed:
+                        await result.window.async_commit(result.start_date, today.strftime('%Y-%m-%d'))
+                    rows = await self._hass.async_add_executor_job(
+                        self._save_window, date.fromisoformat(result.start_date), today, changed)
+                if changed and self._spending is not None:
+                    self._spending.replace_window(result.start_date, today, rows)
+            recompute = changed or result.categories is not None or self.budgets is None or self._budgets_day != today
+            if recompute:
+                await self._async_get_categories(result.categories)
+                earliest = min(budget_period_range(period, today)[0] for period in self._budget_periods)
+                with self.metrics.stage('backfill'):
+                    backfilled = await self._async_backfill(earliest)
+                if self._spending is None or backfilled is not None:
+                    with self.metrics.stage('load'):
+                        self._spending = await self._hass.async_add_executor_job(
+                            self._load_spending, earliest, today)
+                with self.metrics.stage('aggregate'):
+                    self.budgets = {}
+                    for period in self._budget_periods:
+                        self._spending.set_window(period, *budget_period_range(period, today))
+                        self.budgets[period] = summarize_category_totals(
+                            self._spending.totals(period), self._categories or [])
+                self._budgets_day = today
+            if self._statistics is not None:
+                with self.metrics.stage('statistics'):
+                    if result.accounts is not None:
+                        self._statistics.import_balances(self.snapshot.data.get('accounts') or [])
+                    if recompute:
+                        start = date.fromisoformat(result.start_date) if changed else today
+                        if backfilled is not None:
+                            # older days were added, maybe before the previous import
+                            start = min(start, backfilled)
+                        await self._statistics.async_import_spending(self._store, start, today)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            if self.snapshot is not None and (self.stale or self._pc.circuit.state != 'closed'):
+                # personalcapital.com is unhealthy; keep showing the last good data
+                _LOGGER.warning("Error communicating with personalcapital.com, showing the last data: %s", err)
+                return self._data()
+            raise UpdateFailed(f"Error communicating with personalcapital.com: {err}") from err
+        except (RequireTwoFactorException, LoginFailedException) as err:
+            raise UpdateFailed(f"Unable to log in to personalcapital.com: {err}") from err
+        finally:
+            if result is not None and result.window is not None:
+                await result.window.async_discard()
+
+        self.stale = False
+        with self.metrics.stage('persist'):
+            await self._async_save_snapshot()
+        return self._data()
+
+    def _data(self):
+        """Return the coordinator data: everything the sensors show."""
+        return (self.snapshot, self.budgets, self.networth_changes,
+                None if self.holdings is None else self.holdings.version, self.stale)
+
+    def budget(self, period):
+        """Return the category totals of a BUDGET_PERIODS key, or None before the first refresh."""
+        return None if self.budgets is None else self.budgets.get(period)
+
+    def _load_spending(self, start, end):
+        """Build the in-memory spending columns from the budget rows stored since start."""
+        spending = SpendingColumns()
+        spending.load(self._store.spending(start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')))
+        return spending
+
+    async def _async_backfill(self, start):
+        """
+        Make sure the transaction store holds everything since start and
+        return the first day of what was added to it, or None if nothing was.
+
+        The days before the transaction delta that are not stored yet are
+        split into TRANSACTION_WINDOW sized date windows, fetched a few at a
+        time and written to the store as each one arrives (the store keys
+        transactions by id, so the merged result has no duplicates). Each
+        window is recorded as stored on its own, so a failed one is all that
+        is fetched again on the next refresh.
+        """
+        end = self._transactions_start(date.today()) - timedelta(days=1)
+        if start > end:
+            return None
+        ranges = await self._hass.async_add_executor_job(self._store.stored_ranges)
+
+        windows = []
+        for gap_start, gap_end in reversed(missing_ranges(ranges, start, end)):
+            window_end = gap_end
+            while window_end >= gap_start:
+                window_start = max(gap_start, window_end - TRANSACTION_WINDOW + timedelta(days=1))
+                windows.append((window_start, window_end))
+                window_end = window_start - timedelta(days=1)
+        if not windows:
+            return None
+
+        parallel = asyncio.Semaphore(MAX_PARALLEL_WINDOWS)
+        stored = await asyncio.gather(*(self._async_fetch_window(parallel, *window) for window in windows))
+        if not all(stored):
+            _LOGGER.warning("Unable to fetch all transactions since %s, totals may be incomplete", start)
+        return min((window[0] for window, ok in zip(windows, stored) if ok), default=None)
+
+    async def _async_fetch_window(self, parallel, start, end):
+        """
+        Fetch one date window into the transaction store, retrying it on
+        failure. The window's slot in parallel is given up while waiting to
+        retry, so other windows can go ahead.
+        """
+        start_date = start.strftime('%Y-%m-%d')
+        end_date = end.strftime('%Y-%m-%d')
+        for attempt in range(WINDOW_RETRIES):
+            if attempt:
+                await asyncio.sleep(2 ** (attempt - 1))
+            async with parallel:
+                sink = TransactionSink(self._hass, self._store, next(self._batches))
+                try:
+                    result = await self._pc.fetch_stream('/transaction/getUserTransactions', {
+                        'sort_cols': 'transactionTime',
+                        'sort_rev': 'true',
+                        'startDate': start_date,
+                        'endDate': end_date,
+                        'component': 'DATAGRID'
+                    }, TRANSACTIONS_PATH, sink.add)
+                    if getSpHeaderValue(result, SUCCESS_KEY):
+                        await sink.async_commit(start_date, end_date)
+                        await self._hass.async_add_executor_job(self._store.add_stored_range, start, end)
+                        return True
+                    _LOGGER.debug("Transactions %s to %s failed: %s", start_date, end_date, getErrorValue(result))
+                except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                    _LOGGER.debug("Transactions %s to %s failed: %s", start_date, end_date, err)
+                finally:
+                    await sink.async_discard()
+        return False
+
+    @staticmethod
+    def _successful(result):
+        return all(getSpHeaderValue(response, SUCCESS_KEY)
+                   for response in (result.accounts, result.transactions) if response is not None)
+
+    def _apply_accounts(self, now, data):
+        """
+        Publish a new snapshot if the accounts changed and adapt the polling
+        schedule. Accounts whose lastRefreshed moved mean personalcapital.com
+        is aggregating right now, so both schedules speed up.
+        """
+        refreshed = max((account.get('lastRefreshed', 0) for account in data.get('accounts', [])), default=0)
+        active = self._last_refreshed is not None and refreshed > self._last_refreshed
+        self._last_refreshed = refreshed
 
-        if not self.data or not self.data.json()['spHeader']['success']:
-            self._pc.login(self._config[CONF_EMAIL], self._config[CONF_PASSWORD])
-            self.data = self._pc.fetch('/newaccount/getAccounts')
+        changed = self.snapshot is None or self.snapshot.data != data
+        if changed:
+            self._generation += 1
+            self.snapshot = PersonalCapitalSnapshot(self._generation, data)
 
-        self.getTransactions()  
+        self._accounts_schedule.done(now, changed, active)
+        if active:
+            self._transactions_schedule.hurry(now)
 
-    def getTransactions(self):
-        now = datetime.now()
-        date_format = '%Y-%m-%d'
-        start_date = str(now.year) + "-" + str(now.month) + "-1"
-        end_date = now.strftime(date_format)
-        transactions_response = self._pc.fetch('/transaction/getUserTransactions', {
+    async def _async_update_history(self):
+        """
+        Record today's net worth in the history cache and recompute the
+        changes over NETWORTH_CHANGE_DAYS from it.
+
+        The daily balances are backfilled from getHistories once, and
+        afterwards only for the days missed while Home Assistant was not
+        running; otherwise the accounts snapshot provides each day's point.
+        """
+        path = self._hass.config.path(HISTORY_FILE.format(self.suffix))
+        if self._history is None:
+            self._history = await self._hass.async_add_executor_job(NetWorthHistory.load, path)
+        history = self._history
+        data = self.snapshot.data
+        today = date.today()
+
+        changed = False
+        start = today - HISTORY_BACKFILL if history.last_day is None else history.last_day + timedelta(days=1)
+        if start < today and self._history_checked != today:
+            self._history_checked = today
+            changed = await self._async_backfill_history(start, today - timedelta(days=1))
+
+        changed = history.set(
+            today, data.get('networth', 0.0), data.get('assets', 0.0), data.get('liabilities', 0.0)) or changed
+        if changed:
+            history.downsample(today)
+            await self._hass.async_add_executor_job(history.save, path)
+
+        networth = data.get('networth', 0.0)
+        self.networth_changes = {days: history.change(days, today, networth) for days in NETWORTH_CHANGE_DAYS}
+
+    async def _async_backfill_history(self, start, end):
+        """Add the daily balances between start and end to the history. Returns True if any were added."""
+        try:
+            result = await self._pc.fetch('/account/getHistories', {
+                'startDate': start.strftime('%Y-%m-%d'),
+                'endDate': end.strftime('%Y-%m-%d'),
+                'interval': 'DAY',
+                'types': json.dumps(['networth']),
+            })
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            _LOGGER.warning("Unable to fetch the net worth history: %s", err)
+            return False
+        if not getSpHeaderValue(result, SUCCESS_KEY):
+            _LOGGER.warning("Unable to fetch the net worth history: %s", getErrorValue(result))
+            return False
+
+        changed = False
+        for point in (result.get('spData') or {}).get('networthHistories') or []:
+            try:
+                day = date.fromisoformat(point['date'])
+            except (KeyError, TypeError, ValueError):
+                continue
+            changed = self._history.set(
+                day, point.get('networth', 0.0), point.get('totalAssets', 0.0),
+                point.get('totalLiabilities', 0.0)) or changed
+        return changed
+
+    async def _async_login(self):
+        """
+        Log in again, backing off exponentially after failed attempts so the
+        login endpoints are not hit on every refresh.
+        """
+        wait = self._next_login - time.time()
+        if wait > 0:
+            raise UpdateFailed(f"Waiting {round(wait)} seconds before logging in to personalcapital.com again")
+
+        self.metrics.relogins += 1
+        try:
+            await self._pc.login(self._config[CONF_EMAIL], self._config[CONF_PASSWORD])
+        except (RequireTwoFactorException, LoginFailedException, aiohttp.ClientError, asyncio.TimeoutError):
+            backoff = min(LOGIN_BACKOFF * 2 ** self._login_failures, MAX_LOGIN_BACKOFF)
+            self._login_failures += 1
+            self._next_login = time.time() + backoff.total_seconds()
+            raise
+
+        self._login_failures = 0
+        self._next_login = 0
+        await async_save_session(self._hass, self._pc, self.suffix)
+
+    async def _async_open_store(self):
+        """Open the transaction store and resume the month's sync state from it."""
+        store = await self._hass.async_add_executor_job(
+            TransactionStore, self._hass.config.path(TRANSACTIONS_DB.format(self.suffix)))
+        synced, fingerprints, category_ids = await self._hass.async_add_executor_job(
+            self._load_synced, store, date.today())
+        self._store = store
+
+        if synced is not None:
+            self._fingerprints = fingerprints
+            self._category_ids = category_ids
+            self._transactions_synced = synced
+
+    async def async_close_store(self):
+        """Close the transaction store, if it was opened."""
+        store, self._store = self._store, None
+        if store is not None:
+            await self._hass.async_add_executor_job(store.close)
+
+    @staticmethod
+    def _load_synced(store, today):
+        """
+        Return the synced date and the fingerprints and category ids of the
+        stored transactions in the next delta's window.
+        """
+        synced = store.get_meta('synced')
+        if synced is None:
+            return None, {}, set()
+        synced = date.fromisoformat(synced)
+        fingerprints = {}
+        category_ids = set()
+        start = synced - TRANSACTION_SYNC_OVERLAP
+        for transaction in store.transactions(start.strftime('%Y-%m-%d'), today.strftime('%Y-%m-%d')):
+            fingerprints[str(transaction.get('userTransactionId'))] = transaction_fingerprint(transaction)
+            category_ids.update(
+                row['categoryId'] for row in (transaction.get('splits') or [transaction])
+                if row.get('categoryId') is not None)
+        return synced, fingerprints, category_ids
+
+    def _save_window(self, start, end, changed):
+        """Record the sync of the start..end window and return its budget rows if it changed."""
+        self._store.set_meta('synced', self._transactions_synced.isoformat())
+        self._store.add_stored_range(start, end)
+        return self._store.spending(start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')) if changed else None
+
+    async def _async_fetch(self):
+        """
+        Issue the requests that are due concurrently.
+
+        getAccounts and the transaction delta each follow their own schedule
+        and getCategories the category cache TTL. getHoldings, if enabled,
+        goes with getAccounts and covers every account in one call. They
+        share the client's session and its request limit, so a refresh takes
+        about as long as the slowest of them.
+
+        A due transaction delta is skipped while the server change id has not
+        moved since the previous one, unless this refresh's getAccounts
+        response shows that it has, in which case it is requested after it.
+        """
+        now = time.time()
+        start_date = None
+        window = None
+        fetches = {}
+        if self.snapshot is None or self._accounts_schedule.is_due(now):
+            fetches['accounts'] = self._pc.fetch('/newaccount/getAccounts')
+            if self.holdings is not None:
+                fetches['holdings'] = self._pc.fetch('/invest/getHoldings')
+        skipped = False
+        if self.budgets is None or self._transactions_schedule.is_due(now):
+            if self.budgets is not None and self._transactions_unchanged():
+                skipped = True
+                self._transactions_schedule.done(now, False)
+            else:
+                start_date, payload = self._transactions_request()
+                window = TransactionSink(self._hass, self._store, next(self._batches))
+                fetches['transactions'] = self._pc.fetch_stream(
+                    '/transaction/getUserTransactions', payload, TRANSACTIONS_PATH, window.add)
+        ttl = self._config.get(CONF_CATEGORY_CACHE_TTL, DEFAULT_CATEGORY_CACHE_TTL)
+        if now - self._categories_fetched >= ttl.total_seconds():
+            fetches['categories'] = self._pc.fetch('/transactioncategory/getCategories')
+
+        requests = list(fetches.values())
+        responses = []
+        if requests and self._pc.circuit.state == 'half_open':
+            # only one request is let through to probe the circuit; send the rest once it answered
+            responses += await asyncio.gather(requests.pop(0), return_exceptions=True)
+        # wait for every request, so no stream is still staging once this fails
+        responses += await asyncio.gather(*requests, return_exceptions=True)
+        responses = dict(zip(fetches, responses))
+        for response in responses.values():
+            if isinstance(response, BaseException):
+                if window is not None:
+                    await window.async_discard()
+                raise response
+
+        if skipped and not self._transactions_unchanged():
+            start_date, payload = self._transactions_request()
+            window = TransactionSink(self._hass, self._store, next(self._batches))
+            try:
+                responses['transactions'] = await self._pc.fetch_stream(
+                    '/transaction/getUserTransactions', payload, TRANSACTIONS_PATH, window.add)
+            except BaseException:
+                await window.async_discard()
+                raise
+        return RefreshResult(
+            responses.get('accounts'), start_date, responses.get('transactions'), window,
+            responses.get('categories'), responses.get('holdings'))
+
+    def _transactions_unchanged(self):
+        """Return whether the server change id is still the one the previous transaction delta reflected."""
+        change_id = self._pc.last_server_change_id
+        return self._transactions_synced is not None and change_id != "-1" and change_id == self._transactions_change_id
+
+    def _transactions_start(self, today):
+        """
+        Return the first day of the transaction delta: the previous sync less
+        an overlap for pending transactions that post late, reaching back
+        into the previous month if need be, or the start of the month before
+        the first sync.
+        """
+        if self._transactions_synced is None:
+            return today.replace(day=1)
+        return min(today, self._transactions_synced - TRANSACTION_SYNC_OVERLAP)
+
+    def _transactions_request(self):
+        """
+        Return the start date and payload of the transaction delta request.
+
+        Only the days since the previous sync, plus the overlap, are requested.
+        """
+        today = date.today()
+        start_date = self._transactions_start(today).strftime('%Y-%m-%d')
+
+        return start_date, {
             'sort_cols': 'transactionTime',
             'sort_rev': 'true',
             'startDate': start_date,
-            'endDate': end_date,
+            'endDate': today.strftime('%Y-%m-%d'),
             'component': 'DATAGRID'
-        })
-
-        categories = self._pc.fetch('/transactioncategory/getCategories').json()['spData']
-        transactionsData = transactions_response.json()['spData']
-        transactions = transactionsData['transactions']
-
-        splitTransactions = []
-        for i in transactions:
-            if ('splits' in i.keys()):
-                transactions.remove(i)
-                for split in i['splits']:
-                    splitTransactions.append(split)
-
-            
-        df = pandas.DataFrame(transactions)
-        df_filtered = df.loc[df['includeInCashManager'] == True]
-        for category in categories:
-            df_filtered['categoryName'].mask(df_filtered['categoryId'] == category['transactionCategoryId'], category['name'], inplace = True)
-        
-        df_filtered['amount'].mask(
-            (df_filtered['isCashIn'] == True) |
-            (df_filtered['isInterest'] == True) |
-            (df_filtered['isIncome'] == True) |
-            (df_filtered['isCredit'] == True), df['amount'] * -1, inplace=True)
-
-        grouped_df = df_filtered.groupby('categoryName')
-        sum = []
-        for key, item in grouped_df:
-            result = { 'name': key, 'amount': item['amount'].sum(), 'categoryId': item.categoryId.iat[0]}
-            sum.append(result)
+        }
 
-        amount_df = pandas.DataFrame(sum, columns=['name', 'amount', 'categoryId'])
+    def _apply_transactions(self, start_date, window):
+        """
+        Compare a transaction delta (a TransactionSink) with what was held
+        for its window.
 
-        for split in splitTransactions:
-            amount_df['amount'].mask(amount_df['categoryId'] == split['categoryId'], amount_df['amount'] + split['amount'], inplace = True)
+        The response is authoritative for its window, so anything we hold in
+        that window that was not returned (e.g. a pending charge that posted
+        under a new id) counts as a change. Returns True if the window changed.
+        """
+        held = {key: fingerprint for key, fingerprint in self._fingerprints.items() if fingerprint[0] >= start_date}
+        changed = held != window.fingerprints
 
-        sorted_df = amount_df.sort_values(by=['amount'], ascending = False)
-        self.transactions = sorted_df
+        # later deltas start no earlier than this one, so older fingerprints are not needed
+        self._fingerprints = window.fingerprints
+        self._category_ids = window.category_ids
+        self._transactions_synced = date.today()
+        return changed
 
+    async def _async_get_categories(self, result=None):
+        """
+        Return the transaction categories, using a getCategories response from
+        this refresh if there is one. The cache is refetched here only when a
+        transaction refers to a category id it does not contain.
+        """
+        if result is None:
+            known = {category['transactionCategoryId'] for category in self._categories}
+            unknown = self._category_ids - known - self._categories_missing
+            if not unknown:
+                return self._categories
+            result = await self._pc.fetch('/transactioncategory/getCategories')
+        else:
+            unknown = set()
+
+        if not getSpHeaderValue(result, SUCCESS_KEY):
+            _LOGGER.warning("Unable to refresh transaction categories, using the cached list")
+            return self._categories
+
+        self._categories = result['spData']
+        self._categories_fetched = time.time()
+        # ids the server does not know either should not force a refetch every refresh
+        self._categories_missing = unknown - {category['transactionCategoryId'] for category in self._categories}
+        await self._hass.async_add_executor_job(
+            save_categories, self._hass, self._categories, self._categories_fetched, self.suffix)
+        return self._categories
+
+
+def summarize_category_totals(totals, categories):
+    """
+    Name (category id, category name, amount) totals after the cached
+    categories and return [{'name', 'amount', 'categoryId'}] sorted by amount
+    descending. Totals of categories that share a name are added up.
+    """
+    names = {category['transactionCategoryId']: category['name'] for category in categories}
+    amounts = {}
+    category_ids = {}
+    for category_id, category_name, amount in totals:
+        name = names.get(category_id, category_name)
+        if name is None:
+            continue
+        amounts[name] = amounts.get(name, 0.0) + amount
+        category_ids.setdefault(name, category_id)
+    return sorted(
+        ({'name': name, 'amount': amount, 'categoryId': category_ids[name]} for name, amount in amounts.items()),
+        key=lambda category: category['amount'],
+        reverse=True)
+
+
+def budget_period_range(period, today):
+    """Return the (start, end) dates of a BUDGET_PERIODS key."""
+    if period == 'week':
+        return today - timedelta(days=today.weekday()), today
+    if period == 'last_30_days':
+        return today - timedelta(days=29), today
+    if period == 'ytd':
+        return today.replace(month=1, day=1), today
+    if period == 'last_year':
+        return date(today.year - 1, 1, 1), date(today.year - 1, 12, 31)
+    if period == 'last_3_years':
+        return date(today.year - 3, 1, 1), today
+    return today.replace(day=1), today
 
 
 def how_long_ago(last_epoch):
@@ -409,28 +1684,43 @@ def format_balance(inverse_sign, balance):
 csrf_regexp = re.compile(r"window.csrf ='([a-f0-9-]+)'")
 user_agent = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/103.0.0.0 Safari/537.36'
 base_url = 'https://home.personalcapital.com'
-ident_endpoint = base_url + '/page/login/goHome'
-api_endpoint = base_url + '/api'
 
 SP_HEADER_KEY = "spHeader"
 SUCCESS_KEY = "success"
 CSRF_KEY = "csrf"
 AUTH_LEVEL_KEY = "authLevel"
 ERRORS_KEY = "errors"
+LAST_SERVER_CHANGE_ID_KEY = "lastServerChangeId"
+SP_DATA_CHANGES_KEY = "SP_DATA_CHANGES"
 
 def getSpHeaderValue(result, valueKey):
     if (SP_HEADER_KEY in result) and (valueKey in result[SP_HEADER_KEY]):
         return result[SP_HEADER_KEY][valueKey]
     return None
 
+def getServerChangeId(result):
+    """the newest server change id in a response's header, as a string (None if it has none)"""
+    candidates = [getSpHeaderValue(result, LAST_SERVER_CHANGE_ID_KEY)]
+    candidates += [change.get('serverChangeId') for change in getSpHeaderValue(result, SP_DATA_CHANGES_KEY) or []]
+    newest = None
+    for change_id in candidates:
+        try:
+            change_id = int(change_id)
+        except (TypeError, ValueError):
+            continue
+        if newest is None or change_id > int(newest):
+            newest = str(change_id)
+    return newest
+
 def getErrorValue(result):
     try:
         return getSpHeaderValue(result, ERRORS_KEY)[0]['message']
-    except (ValueError, IndexError):
+    except (ValueError, IndexError, TypeError):
         return None
 
 class AuthLevelEnum(object):
     USER_REMEMBERED = "USER_REMEMBERED"
+    SESSION_AUTHENTICATED = "SESSION_AUTHENTICATED"
 
 class TwoFactorVerificationModeEnum(object):
     SMS = 0
@@ -444,16 +1734,47 @@ class LoginFailedException(Exception):
     pass
 
 class PersonalCapital(object):
-    def __init__(self):
-        self.__session = requests.Session()
-        self.__session.headers.update({'user-agent': user_agent})
+    def __init__(self, session=None, base=base_url, max_concurrency=MAX_CONCURRENT_REQUESTS, metrics=None,
+                 timeout=DEFAULT_TIMEOUT, circuit=None, cassette=None):
+        """
+        session is a shared aiohttp.ClientSession; one is created on first use if omitted.
+        at most max_concurrency requests are in flight at once
+        every request is timed into metrics (a PerformanceMetrics, created if omitted)
+        timeout is the aiohttp.ClientTimeout of each request, and circuit the CircuitBreaker
+        that stops requests while personalcapital.com keeps failing (created if omitted)
+        a cassette.Cassette records every api request and response, or replays them instead
+        of sending anything
+        """
+        self.metrics = metrics if metrics is not None else PerformanceMetrics()
+        self.circuit = circuit if circuit is not None else CircuitBreaker()
+        self.cassette = cassette
+        self.__timeout = timeout
+        self.__headers = {'user-agent': user_agent, 'accept-encoding': ACCEPT_ENCODING}
+        self.__session = session
+        self.__owns_session = session is None
+        self.__ident_endpoint = base + '/page/login/goHome'
+        self.__api_endpoint = base + '/api'
+        self.__cookie_url = URL(base)
         self.__csrf = ""
+        self.__last_server_change_id = "-1"
+        self.__requests = asyncio.Semaphore(max_concurrency)
 
-    def login(self, username, password):
-        initial_csrf = self.__get_csrf_from_home_page(ident_endpoint)
+    @property
+    def last_server_change_id(self):
+        """
+        the newest server change id seen in any response ("-1" if none yet)
+        """
+        return self.__last_server_change_id
+
+    async def close(self):
+        if self.__owns_session and self.__session is not None:
+            await self.__session.close()
+
+    async def login(self, username, password):
+        initial_csrf = await self.__get_csrf_from_home_page(self.__ident_endpoint)
         if initial_csrf is None:
           LoginFailedException("Unable to extract initial CSRF token")
-        csrf, auth_level = self.__identify_user(username, initial_csrf)
+        csrf, auth_level = await self.__identify_user(username, initial_csrf)
 
         if csrf is None or auth_level is None:
           LoginFailedException("Unable to extract CSRF token and user auth level")
@@ -461,63 +1782,152 @@ class PersonalCapital(object):
             self.__csrf = csrf
             if auth_level != AuthLevelEnum.USER_REMEMBERED:
                 raise RequireTwoFactorException()
-            result = self.__authenticate_password(password).json()
+            result = await self.__authenticate_password(password)
             if getSpHeaderValue(result, SUCCESS_KEY) == False:
                 raise LoginFailedException(getErrorValue(result))
         else:
             raise LoginFailedException()
 
-    def authenticate_password(self, password):
-        return self.__authenticate_password(password)
+    async def resume_session(self):
+        """
+        checks whether the current csrf and cookies still make an authenticated
+        session, so a saved session can be reused without logging in again
+        """
+        if not self.__csrf:
+            return False
+        result = await self.fetch('/login/querySession')
+        return (getSpHeaderValue(result, SUCCESS_KEY) == True
+                and getSpHeaderValue(result, AUTH_LEVEL_KEY) == AuthLevelEnum.SESSION_AUTHENTICATED)
 
-    def two_factor_authenticate(self, mode, code):
+    async def authenticate_password(self, password):
+        return await self.__authenticate_password(password)
+
+    async def two_factor_authenticate(self, mode, code):
         if mode == TwoFactorVerificationModeEnum.SMS:
-            return self.__authenticate_sms(code)
+            return await self.__authenticate_sms(code)
         elif mode == TwoFactorVerificationModeEnum.EMAIL:
-            return self.__authenticate_email(code)
+            return await self.__authenticate_email(code)
 
-    def two_factor_challenge(self, mode):
+    async def two_factor_challenge(self, mode):
         if mode == TwoFactorVerificationModeEnum.SMS:
-            return self.__challenge_sms()
+            return await self.__challenge_sms()
         elif mode == TwoFactorVerificationModeEnum.EMAIL:
-            return self.__challenge_email()
+            return await self.__challenge_email()
 
-    def fetch(self, endpoint, data = None):
+    async def fetch(self, endpoint, data = None):
         """
         for getting data after logged in
         """
-        payload = {
-            "lastServerChangeId": "-1",
-            "csrf": self.__csrf,
-            "apiClient": "WEB"
-        }
-        if data is not None:
-            payload.update(data)
+        result = await self.post(endpoint, self.__fetch_payload(data), retry=True)
+        self.__track_server_change(result)
+        return result
 
-        return self.post(endpoint, payload)
+    async def fetch_stream(self, endpoint, data, path, callback):
+        """
+        like fetch, but hands each element of the array at path (e.g. ('spData', 'transactions'))
+        to callback as the response streams in instead of decoding the whole body at once.
+        the rest of the response is returned with that array replaced by its length
+        """
+        payload = self.__fetch_payload(data)
+        size = 0
+        delivered = False
+        recorded = [] if self.__recording else None
+
+        async def chunks(response):
+            nonlocal size
+            async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+                size += len(chunk)
+                if recorded is not None:
+                    recorded.append(chunk)
+                yield chunk
+
+        def deliver(element):
+            nonlocal delivered
+            delivered = True
+            return callback(element)
+
+        async def attempt():
+            nonlocal size
+            size = 0
+            if recorded is not None:
+                recorded.clear()
+            try:
+                async with self.__send(endpoint, payload) as response:
+                    try:
+                        return await stream_array(chunks(response), path, deliver)
+                    except ValueError:
+                        return {}
+            except TRANSIENT_ERRORS as err:
+                if delivered:
+                    # callback has seen part of the array, so this can not be retried
+                    raise aiohttp.ClientPayloadError(f"{endpoint} broke off mid-stream: {err!r}") from err
+                raise
+
+        start = time.perf_counter()
+        result = None
+        try:
+            result = await self.__with_retries(attempt, retry=True)
+        finally:
+            self.metrics.record_request(endpoint, time.perf_counter() - start, size,
+                                        getSpHeaderValue(result or {}, SUCCESS_KEY) is True)
+        if recorded is not None:
+            self.cassette.record(endpoint, payload, b''.join(recorded))
+        self.__track_server_change(result)
+        return result
+
+    async def post(self, endpoint, data, retry=False):
+        """
+        posts the form data and returns the decoded json body ({} if it is not json)
+        connection errors, timeouts and 5xx responses are retried with jittered backoff
+        if retry is set, which is only safe for requests that change nothing upstream
+        """
+        body = b''
 
-    def post(self, endpoint, data):
-        response = self.__session.post(api_endpoint + endpoint, data)
-        return response
+        async def attempt():
+            nonlocal body
+            async with self.__send(endpoint, data) as response:
+                body = await response.read()
+
+        start = time.perf_counter()
+        result = None
+        try:
+            await self.__with_retries(attempt, retry)
+            if self.__recording:
+                self.cassette.record(endpoint, data, body)
+            with self.metrics.stage('decode'):
+                try:
+                    result = json.loads(body)
+                except ValueError:
+                    result = {}
+            return result
+        finally:
+            self.metrics.record_request(endpoint, time.perf_counter() - start, len(body),
+                                        getSpHeaderValue(result or {}, SUCCESS_KEY) is True)
 
     def get_session(self):
         """
         return cookies as a dictionary
         """
-        return requests.utils.dict_from_cookiejar(self.__session.cookies)
+        return {cookie.key: cookie.value for cookie in self.__get_session().cookie_jar}
 
     def set_session(self, cookies):
         """
         sets the cookies (should be a dictionary)
         """
-        self.__session.cookies = requests.utils.cookiejar_from_dict(cookies)
+        self.__get_session().cookie_jar.update_cookies(cookies, self.__cookie_url)
+
+    def get_csrf(self):
+        return self.__csrf
+
+    def set_csrf(self, csrf):
+        self.__csrf = csrf
 
     # private methods
 
     def save_session(self, filename):
       session_data = {
           "csrf": self.__csrf,
-          "cookies": self.__session.cookies._cookies, 
+          "cookies": self.get_session(),
       }
       with open(filename, 'wb') as fh:
         pickle.dump(session_data, fh) 
@@ -525,21 +1935,98 @@ class PersonalCapital(object):
     def load_session(self, filename):
       with open(filename, 'rb') as fh:
         data = pickle.load(fh) 
-        jar = requests.cookies.RequestsCookieJar() 
-        jar._cookies = data["cookies"]
-        self.__session.cookies = jar
+        self.set_session(data["cookies"])
         self.__csrf = data["csrf"]
 
 
-    def __get_csrf_from_home_page(self, url):
-        r = self.__session.get(url)
-        found_csrf = csrf_regexp.search(r.text)
+    @property
+    def __recording(self):
+        return self.cassette is not None and self.cassette.recording
+
+    @property
+    def __replaying(self):
+        return self.cassette is not None and self.cassette.replaying
+
+    def __fetch_payload(self, data):
+        payload = {
+            "lastServerChangeId": self.__last_server_change_id,
+            "csrf": self.__csrf,
+            "apiClient": "WEB"
+        }
+        if data is not None:
+            payload.update(data)
+        return payload
+
+    @asynccontextmanager
+    async def __send(self, endpoint, data):
+        """
+        post to an api endpoint, yielding the response once its status is in;
+        retryable statuses raise aiohttp.ClientResponseError
+        """
+        if self.__replaying:
+            yield self.cassette.play(endpoint, data)
+            return
+        async with self.__requests:
+            async with self.__get_session().post(self.__api_endpoint + endpoint, data=data, headers=self.__headers, timeout=self.__timeout) as response:
+                if response.status in RETRY_STATUSES:
+                    response.raise_for_status()
+                yield response
+
+    async def __with_retries(self, attempt, retry):
+        """
+        await attempt(), again after transient failures if retry is set, and
+        keep the circuit breaker informed: the request counts as one failure
+        once its attempts are used up, not one per attempt
+        """
+        probe = self.circuit.admit()
+        settled = False
+        try:
+            attempts = RETRY_ATTEMPTS if retry else 1
+            for number in range(attempts):
+                try:
+                    result = await attempt()
+                except TRANSIENT_ERRORS as err:
+                    if not is_transient(err):
+                        raise
+                    if number + 1 == attempts or self.circuit.state == 'open':
+                        opens = self.circuit.opens
+                        settled = True
+                        self.circuit.failure()
+                        self.metrics.circuit_opens += self.circuit.opens - opens
+                        raise
+                    self.metrics.retries += 1
+                    await asyncio.sleep(retry_delay(number))
+                    continue
+                settled = True
+                self.circuit.success()
+                return result
+        finally:
+            if probe and not settled:
+                self.circuit.release()
+
+    def __track_server_change(self, result):
+        change_id = getServerChangeId(result)
+        if change_id is not None and int(change_id) > int(self.__last_server_change_id):
+            self.__last_server_change_id = change_id
+
+    def __get_session(self):
+        if self.__session is None:
+            self.__session = aiohttp.ClientSession()
+        return self.__session
+
+    async def __get_csrf_from_home_page(self, url):
+        if self.__replaying:
+            return REDACTED
+        self.circuit.check()
+        async with self.__get_session().get(url, headers=self.__headers, timeout=self.__timeout) as r:
+            text = await r.text()
+        found_csrf = csrf_regexp.search(text)
 
         if found_csrf:
             return found_csrf.group(1)
         return None
 
-    def __identify_user(self, username, csrf):
+    async def __identify_user(self, username, csrf):
         """
         Returns reusable CSRF code and the auth level as a 2-tuple
         """
@@ -554,10 +2041,9 @@ class PersonalCapital(object):
             "referrerId": "",
         }
 
-        r = self.post("/login/identifyUser", data)
+        result = await self.post("/login/identifyUser", data)
 
-        if r.status_code == requests.codes.ok:
-            result = r.json()
+        if result:
             new_csrf = getSpHeaderValue(result, CSRF_KEY)
             auth_level = getSpHeaderValue(result, AUTH_LEVEL_KEY)
             return (new_csrf, auth_level)
@@ -584,23 +2070,23 @@ class PersonalCapital(object):
             "csrf": self.__csrf
         }
 
-    def __challenge_email(self):
+    async def __challenge_email(self):
         data = self.__generate_challenge_payload("challengeEmail")
-        return self.post("/credential/challengeEmail", data)
+        return await self.post("/credential/challengeEmail", data)
 
-    def __authenticate_email(self, code):
+    async def __authenticate_email(self, code):
         data = self.__generate_authentication_payload(code)
-        return self.post("/credential/authenticateEmailByCode", data)
+        return await self.post("/credential/authenticateEmailByCode", data)
 
-    def __challenge_sms(self):
+    async def __challenge_sms(self):
         data = self.__generate_challenge_payload("challengeSMS")
-        return self.post("/credential/challengeSms", data)
+        return await self.post("/credential/challengeSms", data)
 
-    def __authenticate_sms(self, code):
+    async def __authenticate_sms(self, code):
         data = self.__generate_authentication_payload(code)
-        return self.post("/credential/authenticateSms", data)
+        return await self.post("/credential/authenticateSms", data)
 
-    def __authenticate_password(self, passwd):
+    async def __authenticate_password(self, passwd):
         data = {
             "bindDevice": "true",
             "deviceName": "Personal Capital Python API",
@@ -612,4 +2098,4 @@ class PersonalCapital(object):
             "apiClient": "WEB",
             "csrf": self.__csrf
         }
-        return self.post("/credential/authenticatePassword", data)
+        return await self.post("/credential/authenticatePassword", data)
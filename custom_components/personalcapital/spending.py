@@ -0,0 +1,193 @@
+"""
+In-memory columnar spending index for the budget sensors.
+
+Every budget row (one per transaction, or per split) is kept in typed array
+columns: the day, the signed amount and the category. Each budget window
+(this week, this month, the last 30 days, the year so far, ...) keeps
+running totals per category that are adjusted as rows are added or
+removed, and as the window moves with the calendar only the days that
+leave or enter it are visited. A refresh therefore costs time in the number
+of new transactions, not in the size of the history.
+"""
+
+from array import array
+from datetime import date
+
+# compact the columns once this many removed rows have piled up
+COMPACT_THRESHOLD = 1024
+
+
+def _ordinal(day):
+    """Return the ordinal of a date or a YYYY-MM-DD string (None if it is not one)."""
+    if isinstance(day, date):
+        return day.toordinal()
+    try:
+        return date.fromisoformat(day[:10]).toordinal()
+    except (TypeError, ValueError):
+        return None
+
+
+def _difference(start, end, other_start, other_end):
+    """Yield the (start, end) ranges of days in start..end that are not in other_start..other_end."""
+    if start > end:
+        return
+    if other_end < start or other_start > end:
+        yield start, end
+        return
+    if start < other_start:
+        yield start, other_start - 1
+    if end > other_end:
+        yield other_end + 1, end
+
+
+class BudgetWindow(object):
+    """Running (count, amount) per category of the rows dated start..end (ordinals, inclusive)."""
+
+    __slots__ = ('start', 'end', 'totals')
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.totals = {}
+
+    def __contains__(self, day):
+        return self.start <= day <= self.end
+
+    def add(self, category, amount, sign=1):
+        count, total = self.totals.get(category, (0, 0.0))
+        count += sign
+        if count:
+            self.totals[category] = (count, total + sign * amount)
+        else:
+            # drop the category rather than keep a float residue of zero
+            self.totals.pop(category, None)
+
+
+class SpendingColumns(object):
+    """Columnar budget rows with incrementally maintained per-window category totals."""
+
+    def __init__(self):
+        self.days = array('i')
+        self.amounts = array('d')
+        self.categories = array('i')
+        self.alive = array('b')
+        self._category_keys = []
+        self._category_index = {}
+        self._by_day = {}
+        self._by_transaction = {}
+        self._removed = 0
+        self._windows = {}
+
+    def __len__(self):
+        return len(self.days) - self._removed
+
+    def load(self, rows):
+        """Add (transaction id, date, category id, category name, amount) rows, e.g. from TransactionStore.spending."""
+        for transaction_id, day, category_id, category_name, amount in rows:
+            ordinal = _ordinal(day)
+            if ordinal is not None:
+                self._add_row(str(transaction_id), ordinal, (category_id, category_name), amount)
+
+    def replace_window(self, start, end, rows):
+        """
+        Replace every row dated start..end (dates or YYYY-MM-DD), and every
+        earlier row of the same transactions, with the given (transaction id,
+        date, category id, category name, amount) rows, e.g. those of
+        TransactionStore.spending for the window after TransactionStore.commit_window.
+        """
+        start, end = _ordinal(start), _ordinal(end)
+        for day in range(start, end + 1):
+            for row in self._by_day.pop(day, ()):
+                self._remove_row(row)
+        rows = list(rows)
+        for transaction_id in {str(row[0]) for row in rows}:
+            for row in self._by_transaction.pop(transaction_id, ()):
+                self._remove_row(row)
+        self.load(rows)
+        if self._removed >= COMPACT_THRESHOLD and self._removed * 2 >= len(self.days):
+            self._compact()
+
+    def set_window(self, name, start, end):
+        """
+        Make the window name cover start..end (dates), creating it if needed.
+        Only the rows of the days that leave or enter the window are visited.
+        """
+        start, end = start.toordinal(), end.toordinal()
+        window = self._windows.get(name)
+        if window is None:
+            window = self._windows[name] = BudgetWindow(start, start - 1)
+        if (window.start, window.end) == (start, end):
+            return
+        old_start, old_end = window.start, window.end
+        for leave_start, leave_end in _difference(old_start, old_end, start, end):
+            self._visit(window, leave_start, leave_end, -1)
+        for enter_start, enter_end in _difference(start, end, old_start, old_end):
+            self._visit(window, enter_start, enter_end, 1)
+        window.start, window.end = start, end
+
+    def totals(self, name):
+        """Return [(category id, category name, amount)] of a window."""
+        return [
+            self._category_keys[category] + (amount,)
+            for category, (count, amount) in self._windows[name].totals.items()
+        ]
+
+    def _visit(self, window, start, end, sign):
+        if end - start > len(self._by_day):
+            days = [day for day in self._by_day if start <= day <= end]
+        else:
+            days = range(start, end + 1)
+        for day in days:
+            for row in self._by_day.get(day, ()):
+                window.add(self.categories[row], self.amounts[row], sign)
+
+    def _category(self, key):
+        index = self._category_index.get(key)
+        if index is None:
+            index = self._category_index[key] = len(self._category_keys)
+            self._category_keys.append(key)
+        return index
+
+    def _add_row(self, transaction_id, day, key, amount):
+        row = len(self.days)
+        category = self._category(key)
+        self.days.append(day)
+        self.amounts.append(amount)
+        self.categories.append(category)
+        self.alive.append(1)
+        self._by_day.setdefault(day, []).append(row)
+        self._by_transaction.setdefault(transaction_id, []).append(row)
+        for window in self._windows.values():
+            if day in window:
+                window.add(category, amount)
+
+    def _remove_row(self, row):
+        if not self.alive[row]:
+            return
+        self.alive[row] = 0
+        self._removed += 1
+        day = self.days[row]
+        rows = self._by_day.get(day)
+        if rows is not None and row in rows:
+            rows.remove(row)
+            if not rows:
+                del self._by_day[day]
+        for window in self._windows.values():
+            if day in window:
+                window.add(self.categories[row], self.amounts[row], -1)
+
+    def _compact(self):
+        """Rebuild the columns without the removed rows."""
+        keep = [row for row in range(len(self.days)) if self.alive[row]]
+        moved = {row: i for i, row in enumerate(keep)}
+        self.days = array('i', (self.days[row] for row in keep))
+        self.amounts = array('d', (self.amounts[row] for row in keep))
+        self.categories = array('i', (self.categories[row] for row in keep))
+        self.alive = array('b', bytes([1]) * len(keep))
+        self._by_day = {day: [moved[row] for row in rows] for day, rows in self._by_day.items()}
+        self._by_transaction = {
+            transaction_id: [moved[row] for row in rows if row in moved]
+            for transaction_id, rows in self._by_transaction.items()
+            if any(row in moved for row in rows)
+        }
+        self._removed = 0
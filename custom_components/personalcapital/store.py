@@ -0,0 +1,264 @@
+"""
+On-disk transaction store for the Personal Capital sensors.
+
+Every transaction fetched from personalcapital.com is upserted into a small
+SQLite database in the Home Assistant config directory, indexed by date,
+category and account, so budget totals for any range can be computed
+without downloading the history again. A response is staged in batches as
+it streams in and only replaces the stored window once it is complete.
+
+All methods block and are meant to be run in the executor.
+"""
+
+import json
+import sqlite3
+import threading
+from datetime import date, timedelta
+
+INFLOW_FLAGS = ('isCashIn', 'isInterest', 'isIncome', 'isCredit')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transactions (
+    id TEXT PRIMARY KEY,
+    date TEXT NOT NULL,
+    account_id TEXT,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS spending (
+    transaction_id TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    account_id TEXT,
+    category_id INTEGER,
+    category_name TEXT,
+    amount REAL NOT NULL,
+    PRIMARY KEY (transaction_id, row)
+);
+CREATE TABLE IF NOT EXISTS staged_transactions (
+    batch INTEGER NOT NULL,
+    id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    account_id TEXT,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS staged_spending (
+    batch INTEGER NOT NULL,
+    transaction_id TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    account_id TEXT,
+    category_id INTEGER,
+    category_name TEXT,
+    amount REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE INDEX IF NOT EXISTS transactions_date ON transactions (date);
+CREATE INDEX IF NOT EXISTS spending_date_category ON spending (date, category_id);
+CREATE INDEX IF NOT EXISTS spending_category_date ON spending (category_id, date);
+CREATE INDEX IF NOT EXISTS spending_account_date ON spending (account_id, date);
+CREATE INDEX IF NOT EXISTS staged_transactions_batch ON staged_transactions (batch);
+CREATE INDEX IF NOT EXISTS staged_spending_batch ON staged_spending (batch);
+"""
+
+
+def spending_rows(transaction):
+    """
+    Yield (category id, category name, signed amount) for each row of a
+    transaction that counts towards the budget.
+
+    A split transaction yields one row per split, each inheriting the
+    parent's flags. Rows not included in the cash manager are skipped and
+    money coming in is negated.
+    """
+    for row in transaction.get('splits') or [transaction]:
+        if row is not transaction:
+            row = {**transaction, **row}
+        if row.get('includeInCashManager') is not True:
+            continue
+        amount = row.get('amount', 0.0)
+        if any(row.get(flag) is True for flag in INFLOW_FLAGS):
+            amount = -amount
+        yield row.get('categoryId'), row.get('categoryName'), amount
+
+
+def merge_ranges(ranges):
+    """Return (start, end) date ranges (inclusive) sorted, with overlapping and adjacent ones merged."""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + timedelta(days=1):
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def missing_ranges(ranges, start, end):
+    """Return the (start, end) ranges of days in start..end not covered by the merged ranges, oldest first."""
+    missing = []
+    for covered_start, covered_end in ranges:
+        if covered_end < start or covered_start > end:
+            continue
+        if covered_start > start:
+            missing.append((start, covered_start - timedelta(days=1)))
+        start = max(start, covered_end + timedelta(days=1))
+    if start <= end:
+        missing.append((start, end))
+    return missing
+
+
+def transaction_account(transaction):
+    account_id = transaction.get('userAccountId', transaction.get('accountId'))
+    return None if account_id is None else str(account_id)
+
+
+class TransactionStore(object):
+    """SQLite store of fetched transactions."""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.executescript(SCHEMA)
+            # batches left over by a refresh that was interrupted
+            self._db.execute("DELETE FROM staged_transactions")
+            self._db.execute("DELETE FROM staged_spending")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def stage(self, batch, transactions):
+        """
+        Add transactions to the staging area of batch, to be written by
+        commit_window once the whole window has arrived.
+        """
+        records = []
+        spending = []
+        for transaction in transactions:
+            transaction_id = str(transaction.get('userTransactionId'))
+            day = transaction.get('transactionDate', '')
+            account_id = transaction_account(transaction)
+            records.append((batch, transaction_id, day, account_id, json.dumps(transaction)))
+            spending.extend(
+                (batch, transaction_id, row, day, account_id, category_id, category_name, amount)
+                for row, (category_id, category_name, amount) in enumerate(spending_rows(transaction)))
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT INTO staged_transactions (batch, id, date, account_id, data) VALUES (?, ?, ?, ?, ?)",
+                records)
+            self._db.executemany(
+                "INSERT INTO staged_spending (batch, transaction_id, row, date, account_id, category_id, "
+                "category_name, amount) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", spending)
+
+    def commit_window(self, batch, start_date, end_date):
+        """
+        Replace everything stored between start_date and end_date (inclusive,
+        YYYY-MM-DD), and any earlier version of the staged transactions, with
+        the transactions staged in batch, which are authoritative for that
+        window. A transaction staged more than once is stored once.
+        """
+        staged = "SELECT id FROM staged_transactions WHERE batch = ?"
+        with self._lock, self._db:
+            self._db.execute(
+                f"DELETE FROM spending WHERE date BETWEEN ? AND ? OR transaction_id IN ({staged})",
+                (start_date, end_date, batch))
+            self._db.execute(
+                f"DELETE FROM transactions WHERE date BETWEEN ? AND ? OR id IN ({staged})",
+                (start_date, end_date, batch))
+            self._db.execute(
+                "INSERT OR REPLACE INTO transactions (id, date, account_id, data) "
+                "SELECT id, date, account_id, data FROM staged_transactions WHERE batch = ? ORDER BY rowid",
+                (batch,))
+            self._db.execute(
+                "INSERT OR REPLACE INTO spending (transaction_id, row, date, account_id, category_id, "
+                "category_name, amount) SELECT transaction_id, row, date, account_id, category_id, "
+                "category_name, amount FROM staged_spending WHERE batch = ? ORDER BY rowid", (batch,))
+            self._discard(batch)
+
+    def discard(self, batch):
+        """Drop the transactions staged in batch."""
+        with self._lock, self._db:
+            self._discard(batch)
+
+    def _discard(self, batch):
+        self._db.execute("DELETE FROM staged_transactions WHERE batch = ?", (batch,))
+        self._db.execute("DELETE FROM staged_spending WHERE batch = ?", (batch,))
+
+    def transactions(self, start_date, end_date):
+        """Return the raw transactions between start_date and end_date."""
+        with self._lock:
+            cursor = self._db.execute(
+                "SELECT data FROM transactions WHERE date BETWEEN ? AND ?", (start_date, end_date))
+            return [json.loads(data) for data, in cursor]
+
+    def spending(self, start_date, end_date):
+        """
+        Return the budget rows between start_date and end_date as
+        [(transaction id, date, category id, category name, amount)].
+        """
+        with self._lock:
+            return self._db.execute(
+                "SELECT transaction_id, date, category_id, category_name, amount FROM spending "
+                "WHERE date BETWEEN ? AND ?", (start_date, end_date)).fetchall()
+
+    def category_totals(self, start_date, end_date, account_id=None):
+        """
+        Return [(category id, category name, amount)] of the spending between
+        start_date and end_date, optionally for a single account.
+        """
+        query = ("SELECT category_id, category_name, SUM(amount) FROM spending "
+                 "WHERE date BETWEEN ? AND ?")
+        args = [start_date, end_date]
+        if account_id is not None:
+            query += " AND account_id = ?"
+            args.append(str(account_id))
+        query += " GROUP BY category_id, category_name"
+        with self._lock:
+            return self._db.execute(query, args).fetchall()
+
+    def daily_category_totals(self, start_date, end_date):
+        """
+        Return [(date, category id, category name, amount)] of the spending
+        per day between start_date and end_date, oldest first.
+        """
+        with self._lock:
+            return self._db.execute(
+                "SELECT date, category_id, category_name, SUM(amount) FROM spending "
+                "WHERE date BETWEEN ? AND ? GROUP BY date, category_id, category_name ORDER BY date",
+                (start_date, end_date)).fetchall()
+
+    def first_date(self):
+        """Return the date of the oldest budget row, or None if there are none."""
+        with self._lock:
+            return self._db.execute("SELECT MIN(date) FROM spending").fetchone()[0]
+
+    def stored_ranges(self):
+        """Return the merged [(start, end)] date ranges whose transactions have all been stored."""
+        with self._lock:
+            return self._stored_ranges()
+
+    def add_stored_range(self, start, end):
+        """Record that every transaction from start to end (dates, inclusive) is stored."""
+        with self._lock, self._db:
+            ranges = merge_ranges(self._stored_ranges() + [(start, end)])
+            self._db.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('stored_ranges', ?)",
+                (json.dumps([[start.isoformat(), end.isoformat()] for start, end in ranges]),))
+
+    def _stored_ranges(self):
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'stored_ranges'").fetchone()
+        if row is None:
+            return []
+        return [(date.fromisoformat(start), date.fromisoformat(end)) for start, end in json.loads(row[0])]
+
+    def get_meta(self, key, default=None):
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def set_meta(self, key, value):
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
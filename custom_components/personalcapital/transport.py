@@ -0,0 +1,117 @@
+"""
+HTTP transport policy for the Personal Capital client.
+
+Timeouts, which failures are retried and how long to wait between attempts,
+response compression, and a circuit breaker that stops calling
+personalcapital.com for a while after repeated failures so the sensors can
+keep showing the last good data instead.
+"""
+
+import asyncio
+import importlib.util
+import random
+import time
+
+import aiohttp
+
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 30
+RETRY_ATTEMPTS = 3
+RETRY_BACKOFF = 0.5
+MAX_RETRY_BACKOFF = 8
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+CIRCUIT_THRESHOLD = 3
+CIRCUIT_RESET = 300
+
+# aiohttp decodes gzip and deflate itself, and br when a brotli package is installed
+ACCEPT_ENCODING = 'gzip, deflate, br' if (
+    importlib.util.find_spec('brotli') or importlib.util.find_spec('brotlicffi')) else 'gzip, deflate'
+
+DEFAULT_TIMEOUT = aiohttp.ClientTimeout(total=None, connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+
+TRANSIENT_ERRORS = (aiohttp.ClientConnectionError, aiohttp.ClientResponseError, asyncio.TimeoutError)
+
+
+class CircuitOpenError(aiohttp.ClientError):
+    """Raised instead of sending a request while the circuit breaker is open."""
+
+
+def is_transient(err):
+    """Return whether a request failing with err is worth retrying."""
+    if isinstance(err, aiohttp.ClientResponseError):
+        return err.status in RETRY_STATUSES
+    return isinstance(err, TRANSIENT_ERRORS)
+
+
+def retry_delay(attempt):
+    """Return the seconds to wait before retry number attempt (0 based), with full jitter."""
+    return random.uniform(0, min(MAX_RETRY_BACKOFF, RETRY_BACKOFF * 2 ** attempt))
+
+
+class CircuitBreaker(object):
+    """
+    Opens after threshold consecutive failed requests and then rejects
+    requests for reset seconds. After that a single probe request is let
+    through while the others are still rejected; the probe failing reopens
+    it and succeeding closes it.
+
+    A request counts as failed once, after its retries are used up.
+    """
+
+    __slots__ = ('threshold', 'reset', 'failures', 'opened', 'opens', 'probing')
+
+    def __init__(self, threshold=CIRCUIT_THRESHOLD, reset=CIRCUIT_RESET):
+        self.threshold = threshold
+        self.reset = reset
+        self.failures = 0
+        self.opened = None
+        self.opens = 0
+        self.probing = False
+
+    @property
+    def state(self):
+        if self.opened is None:
+            return 'closed'
+        return 'open' if time.time() < self.opened + self.reset else 'half_open'
+
+    @property
+    def retry_at(self):
+        """Return the epoch at which requests are let through again, or None if the circuit is closed."""
+        return None if self.opened is None else self.opened + self.reset
+
+    def check(self):
+        """Raise CircuitOpenError if requests are not let through right now."""
+        state = self.state
+        if state == 'open':
+            raise CircuitOpenError(
+                f"personalcapital.com is unhealthy, not calling it for another "
+                f"{round(self.opened + self.reset - time.time())} seconds")
+        if state == 'half_open' and self.probing:
+            raise CircuitOpenError("personalcapital.com is unhealthy, waiting for a probe request to it")
+
+    def admit(self):
+        """
+        Like check, but for a request about to be sent: returns True if it
+        is the half-open probe, which must end in success, failure or release.
+        """
+        self.check()
+        if self.state == 'half_open':
+            self.probing = True
+            return True
+        return False
+
+    def release(self):
+        """Let another probe through after one ended without telling whether the service is healthy."""
+        self.probing = False
+
+    def success(self):
+        self.failures = 0
+        self.opened = None
+        self.probing = False
+
+    def failure(self):
+        self.failures += 1
+        if self.state == 'half_open' or (self.opened is None and self.failures >= self.threshold):
+            self.opens += 1
+            self.opened = time.time()
+        self.probing = False
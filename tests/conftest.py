@@ -0,0 +1,6 @@
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'custom_components'))
+sys.path.insert(0, os.path.join(HERE, '..', 'benchmarks'))
@@ -0,0 +1,79 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+from personalcapital.cassette import RECORD, REDACTED, REPLAY, Cassette, CassetteMissError, redact  # noqa: E402
+
+
+def body(data):
+    return json.dumps({'spHeader': {'success': True, 'csrf': 'secret'}, 'spData': data}).encode()
+
+
+def record(path):
+    cassette = Cassette(path, RECORD)
+    cassette.record('/newaccount/getAccounts', {'csrf': 'secret', 'lastServerChangeId': 1}, body({'networth': 1}))
+    cassette.record('/newaccount/getAccounts', {'csrf': 'secret', 'lastServerChangeId': 2}, body({'networth': 2}))
+    cassette.save()
+    cassette.record('/transaction/getUserTransactions', {'startDate': '2026-10-01', 'endDate': '2026-10-31'},
+                    body({'transactions': []}))
+    cassette.record('/login/querySession', {}, b'not json')
+    assert cassette.dirty
+    cassette.save()
+    assert not cassette.dirty
+
+
+def read(response):
+    return json.loads(asyncio.run(response.read()))
+
+
+def test_redact():
+    assert redact({'username': 'me', 'passwd': '', 'nested': [{'code': '1234', 'keep': 1}]}) == {
+        'username': REDACTED, 'passwd': '', 'nested': [{'code': REDACTED, 'keep': 1}]}
+
+
+def test_record_and_replay(tmp_path):
+    path = str(tmp_path / 'cassette.jsonl.gz')
+    record(path)
+    cassette = Cassette(path, REPLAY).load()
+    # the volatile fields do not take part in the matching, and the last response is served again
+    responses = [cassette.play('/newaccount/getAccounts', {'csrf': 'other', 'lastServerChangeId': 9})
+                 for _ in range(3)]
+    assert [read(response)['spData']['networth'] for response in responses] == [1, 2, 2]
+    assert read(responses[0])['spHeader']['csrf'] == REDACTED
+    window = {'startDate': '2026-10-01', 'endDate': '2026-10-31'}
+    assert read(cassette.play('/transaction/getUserTransactions', window))['spData'] == {'transactions': []}
+    assert asyncio.run(cassette.play('/login/querySession', {'csrf': 'x'}).read()) == b'not json'
+    with pytest.raises(CassetteMissError):
+        cassette.play('/invest/getHoldings', {})
+
+
+def test_other_dates_need_the_fallback(tmp_path, caplog):
+    path = str(tmp_path / 'cassette.jsonl.gz')
+    record(path)
+    window = {'startDate': '2026-11-01', 'endDate': '2026-11-30'}
+    with pytest.raises(CassetteMissError):
+        Cassette(path, REPLAY).load().play('/transaction/getUserTransactions', window)
+    cassette = Cassette(path, REPLAY, fallback=True).load()
+    for _ in range(2):
+        assert read(cassette.play('/transaction/getUserTransactions', window))['spData'] == {'transactions': []}
+    assert len([record for record in caplog.records if record.levelname == 'WARNING']) == 1
+
+
+def test_replay_response_streams(tmp_path):
+    path = str(tmp_path / 'cassette.jsonl.gz')
+    record(path)
+    response = Cassette(path, REPLAY).load().play('/newaccount/getAccounts', {})
+
+    async def chunks():
+        return [chunk async for chunk in response.content.iter_chunked(8)]
+
+    assert b''.join(asyncio.run(chunks())) == asyncio.run(response.read())
+    assert response.status == 200
+
+
+def test_unknown_mode(tmp_path):
+    with pytest.raises(ValueError):
+        Cassette(str(tmp_path / 'cassette.jsonl.gz'), 'rewind')
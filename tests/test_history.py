@@ -0,0 +1,51 @@
+from datetime import date, timedelta
+
+from personalcapital.history import NetWorthHistory
+
+
+def test_set_and_lookup():
+    history = NetWorthHistory()
+    assert history.set(date(2026, 10, 2), 200, 300, 100)
+    assert history.set(date(2026, 10, 1), 100, 200, 100)
+    assert not history.set(date(2026, 10, 1), 100, 200, 100)
+    assert (history.first_day, history.last_day) == (date(2026, 10, 1), date(2026, 10, 2))
+    assert history.value_on(date(2026, 10, 5)) == 200
+    assert history.value_on(date(2026, 9, 30)) is None
+    assert history.change(1, date(2026, 10, 2), 250) == 150
+    assert history.change(30, date(2026, 10, 2), 250) is None
+
+
+def test_downsample():
+    today = date(2026, 10, 16)
+    history = NetWorthHistory()
+    for days in range(800):
+        history.set(today - timedelta(days=days), days, days, 0)
+    assert history.downsample(today)
+    assert not history.downsample(today)
+    days = [date.fromordinal(day) for day in history.days]
+    # daily for the last 120 days, then a point a week, then a point a month
+    assert days[-121:] == [today - timedelta(days=days) for days in range(120, -1, -1)]
+    assert len(history) < 121 + 60 + 14
+    assert history.value_on(today) == 0
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / 'history.bin')
+    history = NetWorthHistory()
+    history.set(date(2026, 10, 1), 100.5, 200.25, 99.75)
+    history.save(path)
+    loaded = NetWorthHistory.load(path)
+    assert list(loaded.days) == list(history.days)
+    assert (loaded.networth[0], loaded.assets[0], loaded.liabilities[0]) == (100.5, 200.25, 99.75)
+
+
+def test_load_unreadable(tmp_path):
+    assert len(NetWorthHistory.load(str(tmp_path / 'missing.bin'))) == 0
+    path = tmp_path / 'history.bin'
+    history = NetWorthHistory()
+    history.set(date(2026, 10, 1), 1, 1, 0)
+    history.save(str(path))
+    path.write_bytes(path.read_bytes()[:-4])
+    assert len(NetWorthHistory.load(str(path))) == 0
+    path.write_bytes(b'nope')
+    assert len(NetWorthHistory.load(str(path))) == 0
@@ -0,0 +1,46 @@
+from personalcapital.holdings import HoldingsTable, security_key
+
+
+def holding(ticker, quantity, price, **fields):
+    return dict({
+        'ticker': ticker,
+        'description': f'{ticker} Fund',
+        'quantity': quantity,
+        'price': price,
+        'value': quantity * price,
+        'oneDayValueChange': 1.0,
+    }, **fields)
+
+
+def test_security_key():
+    assert security_key({'ticker': 'VTI', 'cusip': '123'}) == 'VTI'
+    assert security_key({'cusip': '123', 'description': 'Cash'}) == '123'
+    assert security_key({}) == 'Unknown'
+
+
+def test_positions_are_summed_across_accounts():
+    table = HoldingsTable()
+    assert table.update([holding('VTI', 2, 100.0), holding('VTI', 3, 100.0), holding('BND', 1, 50.0)])
+    assert len(table) == 2
+    assert table.row('VTI') == {
+        'description': 'VTI Fund', 'quantity': 5.0, 'price': 100.0, 'value': 500.0, 'day_change': 2.0}
+    assert table.total_value() == 550.0
+
+
+def test_only_changed_rows_get_a_new_version():
+    table = HoldingsTable()
+    table.update([holding('VTI', 2, 100.0), holding('BND', 1, 50.0)])
+    version = table.version
+    assert not table.update([holding('VTI', 2, 100.0), holding('BND', 1, 50.0)])
+    assert table.version == version
+    assert table.update([holding('VTI', 2, 101.0), holding('BND', 1, 50.0)])
+    assert table.changed_since(version) == ['VTI']
+
+
+def test_securities_no_longer_held_are_removed():
+    table = HoldingsTable()
+    table.update([holding('VTI', 2, 100.0), holding('BND', 1, 50.0), holding('VXUS', 1, 60.0)])
+    assert table.update([holding('VXUS', 1, 60.0)])
+    assert 'VTI' not in table and 'BND' not in table
+    assert table.keys == ['VXUS']
+    assert table.row('VXUS')['value'] == 60.0
@@ -0,0 +1,60 @@
+import asyncio
+import json
+
+import pytest
+
+from personalcapital.jsonstream import stream_array
+
+DOCUMENT = {
+    'spHeader': {'success': True, 'lastServerChangeId': 12},
+    'spData': {
+        'startDate': '2026-10-01',
+        'transactions': [{'id': i, 'amount': i * 1.25e-3, 'name': 'café ☃'} for i in range(50)],
+        'endDate': '2026-10-31',
+    },
+}
+
+
+async def chunked(body, size):
+    for offset in range(0, len(body), size):
+        yield body[offset:offset + size]
+
+
+def stream(body, size, path=('spData', 'transactions'), callback=None):
+    elements = []
+    result = asyncio.run(stream_array(chunked(body, size), path, callback or elements.append))
+    return result, elements
+
+
+@pytest.mark.parametrize('size', [1, 3, 7, 64, 1 << 16])
+def test_stream_array(size):
+    body = json.dumps(DOCUMENT, indent=1).encode()
+    result, elements = stream(body, size)
+    assert elements == DOCUMENT['spData']['transactions']
+    assert result == {
+        'spHeader': DOCUMENT['spHeader'],
+        'spData': {'startDate': '2026-10-01', 'transactions': 50, 'endDate': '2026-10-31'},
+    }
+
+
+def test_coroutine_callbacks_are_awaited():
+    seen = []
+
+    async def callback(element):
+        await asyncio.sleep(0)
+        seen.append(element)
+
+    stream(json.dumps(DOCUMENT).encode(), 16, callback=callback)
+    assert seen == DOCUMENT['spData']['transactions']
+
+
+def test_missing_or_empty_array():
+    result, elements = stream(b'{"spHeader": {"success": false}, "spData": null}', 5)
+    assert (result, elements) == ({'spHeader': {'success': False}, 'spData': None}, [])
+    result, elements = stream(b'{"spData": {"transactions": []}}', 5)
+    assert (result, elements) == ({'spData': {'transactions': 0}}, [])
+
+
+def test_truncated_document():
+    with pytest.raises(ValueError):
+        stream(json.dumps(DOCUMENT).encode()[:-20], 16)
@@ -0,0 +1,75 @@
+from datetime import date
+
+import pytest
+
+pytest.importorskip('homeassistant')
+
+from personalcapital.longterm import save_spending_state, spending_series, statistic_id  # noqa: E402
+from personalcapital.store import TransactionStore  # noqa: E402
+
+CATEGORIES = {1: 'Food', 2: 'Fuel'}
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = TransactionStore(str(tmp_path / 'transactions.db'))
+    yield store
+    store.close()
+
+
+def add(store, *rows):
+    """Store a window of (transaction id, date, category id, amount) rows."""
+    store.stage(1, [{
+        'userTransactionId': transaction_id,
+        'transactionDate': day,
+        'categoryId': category_id,
+        'categoryName': CATEGORIES[category_id],
+        'amount': amount,
+        'includeInCashManager': True,
+    } for transaction_id, day, category_id, amount in rows])
+    store.commit_window(1, min(row[1] for row in rows), max(row[1] for row in rows))
+
+
+def totals(series, category_id):
+    return [total for day, amount, total in series[category_id][1]]
+
+
+def test_statistic_id():
+    assert statistic_id('Partner', 'balance', 1234) == 'personalcapital:partner_balance_1234'
+    assert statistic_id(None, 'spending', 'uncategorized') == 'personalcapital:spending_uncategorized'
+
+
+def test_first_import_covers_the_store_on_the_days_with_spending(store):
+    add(store, (1, '2026-10-01', 1, 10.0), (2, '2026-10-03', 1, 5.0), (3, '2026-10-03', 2, 2.0))
+    series, state = spending_series(store, date(2026, 10, 5), date(2026, 10, 5))
+    assert series == {
+        1: ('Food', [(date(2026, 10, 1), 10.0, 10.0), (date(2026, 10, 3), 5.0, 15.0)]),
+        2: ('Fuel', [(date(2026, 10, 3), 2.0, 2.0)]),
+    }
+    assert state == ('2026-10-01', '2026-10-05', [(1, 'Food'), (2, 'Fuel')])
+
+
+def test_later_imports_continue_the_running_totals(store):
+    add(store, (1, '2026-10-01', 1, 10.0), (2, '2026-10-03', 2, 2.0))
+    save_spending_state(store, spending_series(store, date(2026, 10, 5), date(2026, 10, 5))[1])
+
+    add(store, (3, '2026-10-06', 1, 1.0))
+    series, state = spending_series(store, date(2026, 10, 7), date(2026, 10, 7))
+    # every day since the previous import, of every category imported so far
+    assert series == {
+        1: ('Food', [(date(2026, 10, 6), 1.0, 11.0), (date(2026, 10, 7), 0.0, 11.0)]),
+        2: ('Fuel', [(date(2026, 10, 6), 0.0, 2.0), (date(2026, 10, 7), 0.0, 2.0)]),
+    }
+    assert state[:2] == ('2026-10-01', '2026-10-07')
+
+
+def test_backfill_before_the_origin_moves_it_back(store):
+    add(store, (1, '2026-10-01', 1, 10.0))
+    save_spending_state(store, spending_series(store, date(2026, 10, 5), date(2026, 10, 5))[1])
+
+    add(store, (2, '2026-09-20', 1, 3.0))
+    series, state = spending_series(store, date(2026, 9, 20), date(2026, 10, 5))
+    assert series[1][1][0] == (date(2026, 9, 20), 3.0, 3.0)
+    assert len(series[1][1]) == 16
+    assert totals(series, 1)[-1] == 13.0
+    assert state[:2] == ('2026-09-20', '2026-10-05')
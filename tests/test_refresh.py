@@ -0,0 +1,201 @@
+"""Refreshes of PersonalCapitalAccountData against benchmarks/mockserver.py."""
+
+import asyncio
+import time
+from datetime import date
+
+import pytest
+
+pytest.importorskip('homeassistant')
+
+import aiohttp  # noqa: E402
+from aiohttp import web  # noqa: E402
+from homeassistant.helpers.update_coordinator import UpdateFailed  # noqa: E402
+import mockserver  # noqa: E402
+from bench_refresh import BenchHass, Household  # noqa: E402
+from personalcapital import sensor  # noqa: E402
+from personalcapital.sensor import DEFAULT_CATEGORY_CACHE_TTL, LOGIN_BACKOFF, LoginFailedException  # noqa: E402
+from personalcapital.store import spending_rows  # noqa: E402
+
+TRANSACTIONS = '/transaction/getUserTransactions'
+CATEGORIES = '/transactioncategory/getCategories'
+
+
+def expected_budget(mock, start, end):
+    names = {category['transactionCategoryId']: category['name'] for category in mock.categories}
+    amounts = {}
+    for transaction in mock.transactions:
+        if start.isoformat() <= transaction['transactionDate'] <= end.isoformat():
+            for category_id, category_name, amount in spending_rows(transaction):
+                name = names.get(category_id, category_name)
+                amounts[name] = amounts.get(name, 0.0) + amount
+    return amounts
+
+
+def requests(household, endpoint):
+    stats = household.pc.metrics.endpoints.get(endpoint)
+    return 0 if stats is None else stats.count
+
+
+def run(mock, scenario):
+    """Log a Household in to mock and return what the coroutine function scenario(household) returns."""
+    async def main():
+        runner, base = await mockserver.start(mock)
+        try:
+            async with aiohttp.ClientSession(cookie_jar=aiohttp.CookieJar(unsafe=True)) as session:
+                household = Household(base, session)
+                try:
+                    await household.login()
+                    return await scenario(household)
+                finally:
+                    await household.close()
+        finally:
+            await runner.cleanup()
+
+    return asyncio.run(main())
+
+
+@pytest.fixture
+def mock():
+    return mockserver.MockPersonalCapital(accounts=10, transactions=300, categories=20)
+
+
+def test_refresh(mock):
+    async def scenario(household):
+        await household.refresh()
+        rest = household.rest
+        ranges = await household.hass.async_add_executor_job(rest._store.stored_ranges)
+        return rest.snapshot.data['networth'], rest.budget('month'), ranges
+
+    networth, budget, ranges = run(mock, scenario)
+
+    today = date.today()
+    assert networth == sum(account['balance'] for account in mock.accounts)
+    assert {category['name']: round(category['amount'], 2) for category in budget} == {
+        name: round(amount, 2) for name, amount in expected_budget(mock, today.replace(day=1), today).items()}
+    assert ranges == [(today.replace(day=1), today)]
+
+
+def test_transaction_delta_waits_for_the_change_id(mock):
+    async def scenario(household):
+        counts = []
+        for mutate in (False, False, True, False):
+            if mutate:
+                await household.mutate()
+            await household.refresh()
+            counts.append(requests(household, TRANSACTIONS))
+        return counts, household.rest.snapshot.data['networth']
+
+    counts, networth = run(mock, scenario)
+    # the third refresh only asks once getAccounts shows the change id moved
+    assert counts == [1, 1, 2, 2]
+    assert networth == sum(account['balance'] for account in mock.accounts)
+
+
+def add_transaction(mock, transaction_id, category_id):
+    transaction = dict(mock.transactions[0], userTransactionId=transaction_id, categoryId=category_id,
+                       transactionDate=date.today().isoformat(), includeInCashManager=True, amount=12.5)
+    transaction.pop('splits', None)
+    mock.transactions.append(transaction)
+
+
+def test_categories_are_refetched_after_the_ttl_or_for_unknown_ids(mock):
+    async def scenario(household):
+        rest = household.rest
+        counts = []
+        await household.refresh()
+        await household.refresh()
+        counts.append(requests(household, CATEGORIES))
+        rest._categories_fetched -= DEFAULT_CATEGORY_CACHE_TTL.total_seconds() + 1
+        await household.refresh()
+        counts.append(requests(household, CATEGORIES))
+
+        # a category the cache does not know yet
+        mock.categories.append({'transactionCategoryId': 500, 'name': 'New'})
+        add_transaction(mock, 100000, 500)
+        await household.mutate()
+        await household.refresh()
+        counts.append(requests(household, CATEGORIES))
+        names = {category['name'] for category in rest.budget('month')}
+
+        # a category the server does not know either is only asked about once
+        for transaction_id in (100001, 100002):
+            add_transaction(mock, transaction_id, 600)
+            await household.mutate()
+            await household.refresh()
+            counts.append(requests(household, CATEGORIES))
+        return counts, names
+
+    counts, names = run(mock, scenario)
+    assert counts == [1, 2, 3, 4, 4]
+    assert 'New' in names
+
+
+class FailingLogin(mockserver.MockPersonalCapital):
+    """Rejects the password while fail is set."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fail = False
+        self.attempts = 0
+
+    async def api(self, request):
+        if request.match_info['endpoint'].startswith('credential/'):
+            self.attempts += 1
+            if self.fail:
+                return web.json_response(
+                    {'spHeader': {'success': False, 'errors': [{'message': 'Incorrect password'}]}})
+        return await super().api(request)
+
+
+def test_failed_logins_back_off():
+    mock = FailingLogin(accounts=2, transactions=10)
+
+    async def scenario(household):
+        rest = household.rest
+        mock.fail = True
+        waits = []
+        for _ in range(2):
+            with pytest.raises(LoginFailedException):
+                await rest._async_login()
+            waits.append(round(rest._next_login - time.time()))
+            attempts = mock.attempts
+            with pytest.raises(UpdateFailed):
+                await rest._async_login()
+            assert mock.attempts == attempts
+            # as if the backoff had passed
+            rest._next_login = 0
+        mock.fail = False
+        await rest._async_login()
+        return waits, rest._login_failures, rest._next_login
+
+    waits, failures, next_login = run(mock, scenario)
+    assert waits == [LOGIN_BACKOFF.total_seconds(), 2 * LOGIN_BACKOFF.total_seconds()]
+    assert (failures, next_login) == (0, 0)
+
+
+def test_restart_shows_the_saved_snapshot_until_logged_in(mock, tmp_path):
+    async def scenario(household):
+        await household.refresh()
+        rest = household.rest
+        saved = rest.snapshot.data['networth'], rest.budget('month')
+
+        # a restart: a client that is not logged in yet, over the same config directory
+        pc = sensor.PersonalCapital(household.session, household.base)
+        restarted = sensor.PersonalCapitalAccountData(household.hass, pc, rest._config)
+        assert await restarted.async_restore()
+        restored = await restarted.async_update()
+        assert not pc.metrics.endpoints
+
+        # nothing to show before the first login
+        fresh = sensor.PersonalCapitalAccountData(BenchHass(str(tmp_path)), pc, rest._config)
+        assert not await fresh.async_restore()
+        with pytest.raises(UpdateFailed):
+            await fresh.async_update()
+        return saved, restored, restarted
+
+    (networth, budget), restored, restarted = run(mock, scenario)
+    snapshot, budgets = restored[:2]
+    assert snapshot.data['networth'] == networth
+    assert budgets['month'] == budget
+    assert restarted.stale
@@ -0,0 +1,119 @@
+"""Behaviour of PersonalCapitalAccountData and its helpers, without the network."""
+
+import asyncio
+import time
+from datetime import timedelta
+
+import pytest
+
+pytest.importorskip('homeassistant')
+
+from bench_refresh import BenchHass  # noqa: E402
+from personalcapital import sensor  # noqa: E402
+from personalcapital.sensor import MIN_REFRESH_INTERVAL, RefreshSchedule  # noqa: E402
+
+SLOT = MIN_REFRESH_INTERVAL.total_seconds()
+
+
+@pytest.fixture
+def rest(tmp_path):
+    return sensor.PersonalCapitalAccountData(BenchHass(str(tmp_path)), sensor.PersonalCapital(), {
+        sensor.CONF_EMAIL: 'test@example.com',
+        sensor.CONF_PASSWORD: 'test',
+    })
+
+
+def test_schedule_backs_off_while_nothing_changes():
+    schedule = RefreshSchedule(timedelta(minutes=30))
+    intervals = []
+    for _ in range(4):
+        schedule.done(0, changed=False)
+        intervals.append(schedule.due)
+    assert intervals == [3600, 7200, 7200, 7200]
+    schedule.done(0, changed=True)
+    assert schedule.due == 1800
+    schedule.done(0, changed=False, active=True)
+    assert schedule.due == 900
+
+
+def test_schedule_hurry_only_brings_the_request_forward():
+    schedule = RefreshSchedule(timedelta(minutes=30))
+    schedule.done(0, changed=True)
+    schedule.hurry(0)
+    assert schedule.due == 900
+    schedule.hurry(0)
+    assert schedule.due == 900
+
+
+def test_schedule_aligns_to_the_phase():
+    schedule = RefreshSchedule(timedelta(minutes=30), lambda: 100)
+    schedule.done(1, changed=True)
+    assert schedule.due == 1900
+    schedule.done(150, changed=True)
+    assert schedule.due == 1900 + SLOT
+
+
+def test_schedule_is_due_when_woken_a_moment_early():
+    schedule = RefreshSchedule(timedelta(minutes=30))
+    schedule.done(0, changed=True)
+    assert schedule.is_due(schedule.due - 0.4)
+    assert not schedule.is_due(schedule.due - 5)
+
+
+def test_next_refresh(rest, monkeypatch):
+    monkeypatch.setattr(sensor.time, 'time', lambda: 1000.0)
+    # nothing fetched yet, or the refresh failed
+    assert rest.next_refresh() == MIN_REFRESH_INTERVAL
+    rest._accounts_schedule.due = 1000.0 + 1800
+    rest._transactions_schedule.due = 1000.0 + 3600
+    assert rest.next_refresh() == timedelta(minutes=30)
+    # woken a moment early: the request is not put off by a whole interval
+    rest._accounts_schedule.due = 1000.4
+    assert rest.next_refresh() == timedelta(seconds=sensor.DUE_TOLERANCE)
+
+
+
+def test_phases_are_spread_over_the_logins(tmp_path):
+    hass = BenchHass(str(tmp_path))
+    logins = []
+    for name in ('a', 'b', 'c', 'd', 'e', 'f'):
+        hass.data.setdefault(sensor.DATA_PERSONAL_CAPITAL, {})['personalcapital' + sensor.login_suffix(
+            {sensor.CONF_NAME: name})] = {}
+        logins.append(sensor.PersonalCapitalAccountData(hass, sensor.PersonalCapital(), {
+            sensor.CONF_NAME: name, sensor.CONF_EMAIL: f'{name}@example.com', sensor.CONF_PASSWORD: 'test'}))
+    assert [login._phase() for login in logins] == [SLOT * i / 6 for i in range(6)]
+
+
+def test_half_open_refresh_with_nothing_due(rest):
+    now = time.time()
+    rest.snapshot = sensor.PersonalCapitalSnapshot(0, {})
+    rest.budgets = {}
+    rest._categories_fetched = now
+    rest._accounts_schedule.due = rest._transactions_schedule.due = now + 3600
+    rest._pc.circuit.opened = now - rest._pc.circuit.reset - 1
+    assert rest._pc.circuit.state == 'half_open'
+    result = asyncio.run(rest._async_fetch())
+    assert result.accounts is None and result.transactions is None
+
+
+def test_holdings_attribute_of_the_previous_state_is_left_alone(tmp_path):
+    rest = sensor.PersonalCapitalAccountData(BenchHass(str(tmp_path)), sensor.PersonalCapital(), {
+        sensor.CONF_EMAIL: 'test@example.com',
+        sensor.CONF_PASSWORD: 'test',
+        sensor.CONF_HOLDINGS: True,
+    })
+    rest.holdings.update([{'ticker': 'VTI', 'quantity': 1, 'price': 100.0, 'value': 100.0}])
+    entity = sensor.PersonalCapitalHoldingsSensor(None, rest, 'USD')
+    before = entity.extra_state_attributes[sensor.ATTR_HOLDINGS]
+    rest.holdings.update([
+        {'ticker': 'VTI', 'quantity': 2, 'price': 100.0, 'value': 200.0},
+        {'ticker': 'BND', 'quantity': 1, 'price': 50.0, 'value': 50.0},
+    ])
+    assert entity._refresh()
+    after = entity.extra_state_attributes[sensor.ATTR_HOLDINGS]
+    assert before == {'VTI': {'description': 'VTI', 'quantity': 1.0, 'price': 100.0, 'value': 100.0, 'day_change': 0.0}}
+    assert list(after) == ['VTI', 'BND'] and after['VTI']['value'] == 200.0
+    rest.holdings.update([{'ticker': 'BND', 'quantity': 1, 'price': 50.0, 'value': 50.0}])
+    entity._refresh()
+    assert list(entity.extra_state_attributes[sensor.ATTR_HOLDINGS]) == ['BND']
+    assert list(after) == ['VTI', 'BND']
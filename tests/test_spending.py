@@ -0,0 +1,66 @@
+from datetime import date
+
+from personalcapital import spending
+from personalcapital.spending import SpendingColumns
+
+
+def totals(columns, name):
+    return {category_id: amount for category_id, _, amount in columns.totals(name)}
+
+
+def test_window_totals_follow_the_rows():
+    columns = SpendingColumns()
+    columns.load([
+        ('1', '2026-09-30', 1, 'Food', 10.0),
+        ('2', '2026-10-01', 1, 'Food', 5.0),
+        ('3', '2026-10-02', 2, 'Fuel', 20.0),
+    ])
+    columns.set_window('month', date(2026, 10, 1), date(2026, 10, 31))
+    assert totals(columns, 'month') == {1: 5.0, 2: 20.0}
+
+    columns.replace_window('2026-10-02', '2026-10-02', [('3', '2026-10-02', 2, 'Fuel', 30.0)])
+    assert totals(columns, 'month') == {1: 5.0, 2: 30.0}
+    assert len(columns) == 3
+
+
+def test_moving_a_window_only_visits_the_changed_days():
+    columns = SpendingColumns()
+    columns.load([
+        ('1', '2026-10-01', 1, 'Food', 10.0),
+        ('2', '2026-10-15', 1, 'Food', 5.0),
+        ('3', '2026-11-01', 1, 'Food', 1.0),
+    ])
+    columns.set_window('30 days', date(2026, 10, 1), date(2026, 10, 30))
+    assert totals(columns, '30 days') == {1: 15.0}
+    columns.set_window('30 days', date(2026, 10, 2), date(2026, 11, 1))
+    assert totals(columns, '30 days') == {1: 6.0}
+
+
+def test_replace_window_drops_a_transaction_that_moved():
+    columns = SpendingColumns()
+    columns.load([('1', '2026-09-30', 1, 'Food', 10.0)])
+    columns.set_window('all', date(2026, 1, 1), date(2026, 12, 31))
+    columns.replace_window(date(2026, 10, 1), date(2026, 10, 31), [('1', '2026-10-01', 1, 'Food', 10.0)])
+    assert totals(columns, 'all') == {1: 10.0}
+    assert len(columns) == 1
+
+
+def test_a_category_whose_rows_are_gone_is_dropped():
+    columns = SpendingColumns()
+    columns.load([('1', '2026-10-01', 1, 'Food', 0.1), ('2', '2026-10-01', 2, 'Fuel', 0.2)])
+    columns.set_window('month', date(2026, 10, 1), date(2026, 10, 31))
+    columns.replace_window('2026-10-01', '2026-10-31', [('2', '2026-10-01', 2, 'Fuel', 0.2)])
+    assert totals(columns, 'month') == {2: 0.2}
+
+
+def test_compaction_keeps_the_totals(monkeypatch):
+    monkeypatch.setattr(spending, 'COMPACT_THRESHOLD', 4)
+    columns = SpendingColumns()
+    columns.set_window('month', date(2026, 10, 1), date(2026, 10, 31))
+    for amount in range(1, 11):
+        columns.replace_window('2026-10-01', '2026-10-02', [
+            ('1', '2026-10-01', 1, 'Food', float(amount)), ('2', '2026-10-02', 2, 'Fuel', 1.0)])
+    assert len(columns.days) < 20
+    assert totals(columns, 'month') == {1: 10.0, 2: 1.0}
+    columns.set_window('month', date(2026, 10, 2), date(2026, 10, 31))
+    assert totals(columns, 'month') == {2: 1.0}
@@ -0,0 +1,113 @@
+from datetime import date
+
+import pytest
+
+from personalcapital.store import TransactionStore, merge_ranges, missing_ranges, spending_rows
+
+
+def transaction(transaction_id, day, amount, category_id=1, **fields):
+    return dict({
+        'userTransactionId': transaction_id,
+        'transactionDate': day,
+        'amount': amount,
+        'categoryId': category_id,
+        'categoryName': f'Category {category_id}',
+        'includeInCashManager': True,
+        'userAccountId': 7,
+    }, **fields)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = TransactionStore(str(tmp_path / 'transactions.db'))
+    yield store
+    store.close()
+
+
+def test_spending_rows_splits_and_inflows():
+    rows = list(spending_rows(transaction(1, '2026-10-01', 30.0, isCredit=True, splits=[
+        {'categoryId': 2, 'amount': 10.0},
+        {'categoryId': 3, 'amount': 20.0, 'includeInCashManager': False},
+    ])))
+    assert rows == [(2, 'Category 1', -10.0)]
+
+
+def test_commit_window_replaces_the_window(store):
+    store.stage(1, [transaction(1, '2026-10-01', 10.0), transaction(2, '2026-10-02', 20.0)])
+    store.commit_window(1, '2026-10-01', '2026-10-31')
+    store.stage(2, [transaction(2, '2026-10-03', 25.0)])
+    store.commit_window(2, '2026-10-01', '2026-10-31')
+    assert store.spending('2026-10-01', '2026-10-31') == [('2', '2026-10-03', 1, 'Category 1', 25.0)]
+    assert [t['userTransactionId'] for t in store.transactions('2026-10-01', '2026-10-31')] == [2]
+
+
+def test_commit_window_moves_a_transaction_out_of_another_window(store):
+    store.stage(1, [transaction(1, '2026-09-30', 10.0)])
+    store.commit_window(1, '2026-09-01', '2026-09-30')
+    store.stage(2, [transaction(1, '2026-10-01', 10.0)])
+    store.commit_window(2, '2026-10-01', '2026-10-31')
+    assert store.spending('2026-09-01', '2026-10-31') == [('1', '2026-10-01', 1, 'Category 1', 10.0)]
+
+
+def test_discard_leaves_the_store_alone(store):
+    store.stage(1, [transaction(1, '2026-10-01', 10.0)])
+    store.commit_window(1, '2026-10-01', '2026-10-31')
+    store.stage(2, [transaction(2, '2026-10-02', 20.0)])
+    store.discard(2)
+    store.commit_window(2, '2026-11-01', '2026-11-30')
+    assert store.category_totals('2026-10-01', '2026-11-30') == [(1, 'Category 1', 10.0)]
+
+
+def test_staged_batches_are_dropped_on_open(tmp_path):
+    path = str(tmp_path / 'transactions.db')
+    store = TransactionStore(path)
+    store.stage(1, [transaction(1, '2026-10-01', 10.0)])
+    store.close()
+    store = TransactionStore(path)
+    store.commit_window(1, '2026-10-01', '2026-10-31')
+    assert store.first_date() is None
+    store.close()
+
+
+def test_totals(store):
+    store.stage(1, [
+        transaction(1, '2026-10-01', 10.0),
+        transaction(2, '2026-10-01', 5.0, category_id=2, userAccountId=8),
+        transaction(3, '2026-10-02', 2.5),
+    ])
+    store.commit_window(1, '2026-10-01', '2026-10-31')
+    assert sorted(store.category_totals('2026-10-01', '2026-10-31')) == [
+        (1, 'Category 1', 12.5), (2, 'Category 2', 5.0)]
+    assert store.category_totals('2026-10-01', '2026-10-31', account_id=8) == [(2, 'Category 2', 5.0)]
+    assert store.daily_category_totals('2026-10-01', '2026-10-31') == [
+        ('2026-10-01', 1, 'Category 1', 10.0), ('2026-10-01', 2, 'Category 2', 5.0),
+        ('2026-10-02', 1, 'Category 1', 2.5)]
+    assert store.first_date() == '2026-10-01'
+
+
+def test_ranges():
+    ranges = merge_ranges([
+        (date(2026, 3, 1), date(2026, 3, 31)),
+        (date(2026, 1, 1), date(2026, 1, 31)),
+        (date(2026, 2, 1), date(2026, 2, 10)),
+    ])
+    assert ranges == [(date(2026, 1, 1), date(2026, 2, 10)), (date(2026, 3, 1), date(2026, 3, 31))]
+    assert missing_ranges(ranges, date(2025, 12, 1), date(2026, 4, 30)) == [
+        (date(2025, 12, 1), date(2025, 12, 31)),
+        (date(2026, 2, 11), date(2026, 2, 28)),
+        (date(2026, 4, 1), date(2026, 4, 30)),
+    ]
+    assert missing_ranges(ranges, date(2026, 1, 5), date(2026, 1, 20)) == []
+
+
+def test_stored_ranges(store):
+    assert store.stored_ranges() == []
+    store.add_stored_range(date(2026, 9, 1), date(2026, 9, 30))
+    store.add_stored_range(date(2026, 10, 1), date(2026, 10, 16))
+    assert store.stored_ranges() == [(date(2026, 9, 1), date(2026, 10, 16))]
+
+
+def test_meta(store):
+    assert store.get_meta('missing', 'default') == 'default'
+    store.set_meta('key', 'value')
+    assert store.get_meta('key') == 'value'
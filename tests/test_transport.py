@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+
+from personalcapital import transport  # noqa: E402
+from personalcapital.transport import CircuitBreaker, CircuitOpenError, is_transient, retry_delay  # noqa: E402
+
+
+def response_error(status):
+    return aiohttp.ClientResponseError(None, (), status=status)
+
+
+def test_is_transient():
+    assert is_transient(aiohttp.ServerDisconnectedError())
+    assert is_transient(asyncio.TimeoutError())
+    assert is_transient(response_error(503))
+    assert not is_transient(response_error(404))
+    assert not is_transient(ValueError())
+
+
+def test_retry_delay_is_capped():
+    for attempt in range(10):
+        assert 0 <= retry_delay(attempt) <= min(transport.MAX_RETRY_BACKOFF, transport.RETRY_BACKOFF * 2 ** attempt)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(transport.time, 'time', lambda: now[0])
+    return now
+
+
+def test_circuit_opens_after_threshold(clock):
+    circuit = CircuitBreaker(threshold=2, reset=60)
+    circuit.failure()
+    assert circuit.state == 'closed'
+    circuit.failure()
+    assert circuit.state == 'open'
+    assert circuit.retry_at == 1060.0
+    with pytest.raises(CircuitOpenError):
+        circuit.admit()
+
+
+def test_half_open_lets_one_probe_through(clock):
+    circuit = CircuitBreaker(threshold=1, reset=60)
+    circuit.failure()
+    clock[0] += 61
+    assert circuit.state == 'half_open'
+    assert circuit.admit()
+    with pytest.raises(CircuitOpenError):
+        circuit.check()
+    circuit.release()
+    assert circuit.admit()
+    circuit.success()
+    assert circuit.state == 'closed'
+    assert not circuit.admit()
+
+
+def test_failed_probe_reopens(clock):
+    circuit = CircuitBreaker(threshold=1, reset=60)
+    circuit.failure()
+    clock[0] += 61
+    assert circuit.admit()
+    circuit.failure()
+    assert circuit.state == 'open'
+    assert circuit.opens == 2
+    assert not circuit.probing